@@ -4,7 +4,7 @@ import json
 import logging
 from logging.handlers import RotatingFileHandler
 
-from fastapi import FastAPI, BackgroundTasks, Header, HTTPException, Request
+from fastapi import FastAPI, Header, HTTPException, Request
 from dotenv import load_dotenv
 import gspread
 from google.oauth2.service_account import Credentials
@@ -17,6 +17,8 @@ sys.path.append(BASE_DIR)
 sys.path.append(os.path.join(BASE_DIR, "modules"))
 
 from modules.processor import process_sheet
+from modules.jobs import JobManager
+from autofill.paapi_autofill import paapi_stats
 
 # -------------------------------------------------------------
 # ENVIRONMENT VARIABLES
@@ -59,6 +61,9 @@ logger.info("🚀 Starting Image Automation Server (Render Ready)")
 # -------------------------------------------------------------
 app = FastAPI(title="Image Automation API", version="2.0")
 
+# One active job per sheet; repeated /run calls coalesce into it
+jobs = JobManager()
+
 
 # -------------------------------------------------------------
 # OPENAPI (Swagger) PUBLIC ACCESS
@@ -145,17 +150,56 @@ def health(x_api_key: str = Header(None), request: Request = None):
 # MAIN RUN ENDPOINT
 # -------------------------------------------------------------
 @app.post("/run")
-def run(background_tasks: BackgroundTasks,
-        x_api_key: str = Header(None),
+def run(x_api_key: str = Header(None),
         request: Request = None):
 
     verify_api_key(x_api_key, request)
 
+    sheet_key = f"{SHEET_ID}:{SHEET_NAME or ''}"
+    active = jobs.coalesce(sheet_key)
+    if active:
+        logger.info(f"↺ /run coalesced into running job {active.id}")
+        return {"status": "already_running", "job_id": active.id, "rerun_queued": True}
+
     logger.info("🔥 /run triggered — loading Google Sheet...")
     sheet = load_sheet()
 
     # Background processing (non-blocking in Render)
-    background_tasks.add_task(process_sheet, sheet, FREEIMAGE_API_KEY)
+    job, started = jobs.submit(
+        sheet_key,
+        lambda job: process_sheet(sheet, FREEIMAGE_API_KEY, progress=job),
+    )
+
+    if not started:
+        logger.info(f"↺ /run coalesced into running job {job.id}")
+        return {"status": "already_running", "job_id": job.id, "rerun_queued": True}
+
+    logger.info(f"✔ Job {job.id} queued successfully.")
+    return {"status": "processing_started", "job_id": job.id}
+
+
+# -------------------------------------------------------------
+# JOB STATUS
+# -------------------------------------------------------------
+@app.get("/jobs/{job_id}")
+def job_status(job_id: str,
+               x_api_key: str = Header(None),
+               request: Request = None):
 
-    logger.info("✔ Task queued successfully.")
-    return {"status": "processing_started"}
+    verify_api_key(x_api_key, request)
+
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
+
+# -------------------------------------------------------------
+# PA-API STATS
+# -------------------------------------------------------------
+@app.get("/stats/paapi")
+def paapi_status(x_api_key: str = Header(None),
+                 request: Request = None):
+
+    verify_api_key(x_api_key, request)
+    return paapi_stats()
@@ -1,28 +1,130 @@
 # autofill/asin_extractor.py
 
+import time
 import logging
-from urllib.parse import urlparse
+from urllib.parse import urlparse, urljoin
 import re
-import requests
+
+from modules.http_session import get_session
+from modules.local_store import LocalStore
 
 logger = logging.getLogger(__name__)
 
 
 SHORT_DOMAINS = {"amzn.to"}
 
+# Hops followed when resolving a short link
+MAX_REDIRECTS = 10
+
+ASIN_PATTERNS = [
+    r"/dp/([A-Z0-9]{10})",
+    r"/gp/product/([A-Z0-9]{10})",
+    r"/product/([A-Z0-9]{10})",
+    r"/ASIN/([A-Z0-9]{10})",
+    r"/dp/([A-Z0-9]{10})",
+    r"([A-Z0-9]{10})(?:[/?]|$)",
+]
+
+# Short links never change their target: short URL -> expanded URL -> ASIN,
+# resolved once and kept for good
+_links = LocalStore("short_links.sqlite3", """
+CREATE TABLE IF NOT EXISTS short_links (
+    short_url    TEXT PRIMARY KEY,
+    expanded_url TEXT NOT NULL,
+    asin         TEXT NOT NULL,
+    resolved_at  REAL NOT NULL
+);
+""")
+
+
+def _is_short(url: str) -> bool:
+    return (urlparse(url).hostname or "").lower() in SHORT_DOMAINS
+
+
+def _match_asin(url: str) -> str:
+    for p in ASIN_PATTERNS:
+        m = re.search(p, url)
+        if m:
+            return m.group(1)
+    return ""
+
+
+def _cached_link(url: str):
+    """(expanded_url, asin) of a short link resolved before, or None."""
+    try:
+        rows = _links.query(
+            "SELECT expanded_url, asin FROM short_links WHERE short_url = ?", (url,)
+        )
+    except Exception as e:
+        logger.warning(f"Short link cache unavailable: {e}")
+        return None
+    return rows[0] if rows else None
+
+
+def _remember_link(url: str, expanded: str, asin: str):
+    try:
+        _links.execute(
+            "INSERT OR REPLACE INTO short_links (short_url, expanded_url, asin, resolved_at) "
+            "VALUES (?, ?, ?, ?)",
+            (url, expanded, asin, time.time()),
+        )
+    except Exception as e:
+        logger.warning(f"Failed to cache short link {url}: {e}")
+
+
+def _next_location(url: str):
+    """
+    Redirect target of `url`, or None if it does not redirect. Uses HEAD;
+    servers that refuse HEAD get a streamed GET whose body is never read.
+    """
+    session = get_session()
+    resp = session.head(url, timeout=10, allow_redirects=False)
+    if not resp.is_redirect and resp.status_code >= 400:
+        with session.get(url, timeout=10, allow_redirects=False, stream=True) as get:
+            resp = get
+    if not resp.is_redirect:
+        resp.raise_for_status()
+        return None
+    return urljoin(url, resp.headers["Location"])
+
+
+def _follow_redirects(url: str) -> str:
+    """
+    Follow Location headers hop by hop, stopping as soon as the URL has
+    left the short-link domains and names an ASIN, so the product page
+    itself is never downloaded.
+    """
+    current = url
+    for _ in range(MAX_REDIRECTS):
+        if not _is_short(current) and _match_asin(current):
+            break
+        location = _next_location(current)
+        if not location:
+            break
+        current = location
+    return current
+
 
 def _expand_if_short(url: str) -> str:
     """
-    If URL is an Amazon short link (amzn.to), follow redirects
-    to get the full URL. Otherwise return original.
+    If URL is an Amazon short link (amzn.to), resolve its redirects to
+    get the full URL (cached for good). Otherwise return original.
     """
     try:
-        parsed = urlparse(url)
-        host = (parsed.hostname or "").lower()
-        if host in SHORT_DOMAINS:
-            resp = requests.get(url, timeout=10, allow_redirects=True)
-            resp.raise_for_status()
-            return resp.url
+        if not _is_short(url):
+            return url
+
+        cached = _cached_link(url)
+        if cached:
+            return cached[0]
+
+        expanded = _follow_redirects(url)
+        # Only a chain that reached a product page is final; anything
+        # else (hop limit, non-product page) is retried next time
+        asin = _match_asin(expanded)
+        if asin and not _is_short(expanded):
+            _remember_link(url, expanded, asin)
+        return expanded
     except Exception as e:
         logger.warning(f"Failed to expand short URL {url}: {e}")
     return url
@@ -36,22 +138,16 @@ def extract_asin(url: str) -> str:
     if not url:
         return ""
 
+    if _is_short(url):
+        cached = _cached_link(url)
+        if cached and cached[1]:
+            return cached[1]
+
     final_url = _expand_if_short(url)
-    patterns = [
-        r"/dp/([A-Z0-9]{10})",
-        r"/gp/product/([A-Z0-9]{10})",
-        r"/product/([A-Z0-9]{10})",
-        r"/ASIN/([A-Z0-9]{10})",
-        r"/dp/([A-Z0-9]{10})",
-        r"([A-Z0-9]{10})(?:[/?]|$)",
-    ]
-
-    for p in patterns:
-        m = re.search(p, final_url)
-        if m:
-            asin = m.group(1)
-            logger.debug(f"Extracted ASIN {asin} from URL {final_url}")
-            return asin
+    asin = _match_asin(final_url)
+    if asin:
+        logger.debug(f"Extracted ASIN {asin} from URL {final_url}")
+        return asin
 
     logger.warning(f"Could not extract ASIN from URL: {final_url}")
     return ""
@@ -6,6 +6,7 @@ from urllib.parse import urlparse
 from autofill.asin_extractor import extract_asin
 from autofill.paapi_autofill import fetch_product_data
 from autofill.promo_scraper import extract_promo_from_html
+from autofill import product_cache
 
 try:
     import requests
@@ -19,9 +20,14 @@ import json
 
 logger = logging.getLogger(__name__)
 
-def get_product_data(url: str) -> dict:
+def get_product_data(url: str, asin: str = None, pa: dict = None, cached: dict = None) -> dict:
     """
     Unified autofill engine.
+    `asin` / `pa` / `cached` may carry the ASIN, PA-API result and
+    product_cache.lookup() already done for this URL (see
+    fetch_product_data_many); they are not looked up again.
+    Results are cached per ASIN (autofill/product_cache.py); only field
+    groups past their TTL are fetched again.
     Returns:
     {
         "asin": "",
@@ -56,21 +62,38 @@ def get_product_data(url: str) -> dict:
         return base
 
     try:
-        asin = extract_asin(url)
+        if asin is None:
+            asin = extract_asin(url)
         base["asin"] = asin
 
+        # --- PRODUCT CACHE (fresh field groups skip the network) ---
+        if cached is None:
+            cached = product_cache.lookup(asin)
+        for fields in cached.values():
+            base.update(fields)
+        stale = product_cache.stale_groups(cached)
+        if not stale:
+            return base
+
         # --- PA-API autofill ---
-        pa = fetch_product_data(asin)
+        if pa is None:
+            pa = fetch_product_data(asin)
         for k in ["title", "image", "price", "reg_price", "promo"]:
-            base[k] = pa.get(k, base[k])
+            if any(k in product_cache.GROUPS[g] for g in stale):
+                base[k] = pa.get(k, base[k])
 
         # --- PROMO CODE SCRAPER ---
-        promo_code = extract_promo_from_html(url)
-        base["promo_code"] = promo_code
+        if "promo" in stale:
+            promo_code = extract_promo_from_html(url)
+            base["promo_code"] = promo_code
 
         # --- FALLBACK: HTML scraping if PA-API didn't return enough (title/image/price/reg) ---
         # We will attempt to fetch the HTML and parse common meta tags, JSON-LD and domain-specific selectors
-        if (not base.get("title") or not base.get("image") or not base.get("price") or not base.get("reg_price")) and HAS_BS4:
+        missing = [
+            f for g in stale if g in ("info", "price")
+            for f in product_cache.GROUPS[g] if not base.get(f)
+        ]
+        if missing and HAS_BS4:
             try:
                 r = requests.get(url, timeout=8, headers={"User-Agent": "Mozilla/5.0"})
                 r.raise_for_status()
@@ -144,6 +167,7 @@ def get_product_data(url: str) -> dict:
                 # fallback silently if we can't scrape
                 pass
 
+        product_cache.store(asin, base, stale)
         return base
 
     except Exception as e:
@@ -1,7 +1,12 @@
 # autofill/paapi_autofill.py
 
 import os
+import time
+import random
 import logging
+import threading
+
+from modules.local_store import LocalStore
 
 logger = logging.getLogger(__name__)
 
@@ -12,9 +17,136 @@ except ImportError:
     logger.error("amazon_paapi library not installed. PA-API autofill will be disabled.")
 
 
+# Requests per second the PA-API account allows (grows with sales), and
+# how many may go out back to back after a quiet period
+PAAPI_TPS = float(os.getenv("PAAPI_TPS", "1"))
+PAAPI_BURST = int(os.getenv("PAAPI_BURST", "1"))
+# "shared": one bucket for every worker process on the host (SQLite in
+# STATE_DIR, like row_leases); "process": a bucket per process, so N
+# uvicorn workers may send N x PAAPI_TPS
+PAAPI_LIMITER = os.getenv("PAAPI_LIMITER", "shared").strip().lower()
+# Retries of a throttled (TooManyRequests) call, with jittered backoff
+PAAPI_MAX_RETRIES = int(os.getenv("PAAPI_MAX_RETRIES", "3"))
+PAAPI_RETRY_BASE = float(os.getenv("PAAPI_RETRY_BASE", "1.0"))
+
+
+class TokenBucket:
+    """Blocking token bucket: `rate` tokens per second, at most `burst` saved up."""
+
+    def __init__(self, rate, burst=1):
+        self.rate = max(rate, 0.001)
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class SharedTokenBucket(TokenBucket):
+    """
+    TokenBucket whose state lives in STATE_DIR, so all worker processes
+    on the host draw from the same PAAPI_TPS. Taking a token is a single
+    conditional UPDATE, which SQLite serializes across processes. Falls
+    back to the in-process bucket if the store is unavailable.
+    """
+
+    def __init__(self, rate, burst=1, name="paapi"):
+        super().__init__(rate, burst)
+        self.name = name
+        self._store = LocalStore("paapi_rate.sqlite3", """
+CREATE TABLE IF NOT EXISTS rate_buckets (
+    name    TEXT PRIMARY KEY,
+    tokens  REAL NOT NULL,
+    updated REAL NOT NULL
+);
+""")
+
+    def _refilled(self):
+        return "MIN(:burst, tokens + MAX(0, :now - updated) * :rate)"
+
+    def _take(self):
+        """Take a token; returns 0 on success, else seconds to wait."""
+        params = {"name": self.name, "burst": self.burst, "rate": self.rate, "now": time.time()}
+        self._store.execute(
+            "INSERT OR IGNORE INTO rate_buckets (name, tokens, updated) VALUES (:name, :burst, :now)",
+            params,
+        )
+        taken = self._store.execute(
+            f"UPDATE rate_buckets SET tokens = {self._refilled()} - 1, updated = :now "
+            f"WHERE name = :name AND {self._refilled()} >= 1",
+            params,
+        )
+        if taken:
+            return 0
+        rows = self._store.query(
+            f"SELECT {self._refilled()} FROM rate_buckets WHERE name = :name", params
+        )
+        tokens = rows[0][0] if rows else 0
+        return max(0.01, (1 - tokens) / self.rate)
+
+    def acquire(self):
+        while True:
+            try:
+                wait = self._take()
+            except Exception as e:
+                logger.warning(f"Shared PA-API rate limit unavailable ({e}); limiting per process")
+                return super().acquire()
+            if not wait:
+                return
+            time.sleep(wait)
+
+
+_clients = {}  # (access_key, secret_key, partner_tag, region) -> client
+_clients_lock = threading.Lock()
+_limiter = (
+    SharedTokenBucket(PAAPI_TPS, PAAPI_BURST) if PAAPI_LIMITER == "shared"
+    else TokenBucket(PAAPI_TPS, PAAPI_BURST)
+)
+
+_stats = {
+    "requests": 0,
+    "items_requested": 0,
+    "throttled": 0,
+    "retries": 0,
+    "errors": 0,
+    "latency_total_s": 0.0,
+    "latency_max_s": 0.0,
+}
+_stats_lock = threading.Lock()
+
+
+def _count(**deltas):
+    with _stats_lock:
+        for name, value in deltas.items():
+            _stats[name] += value
+
+
+def paapi_stats() -> dict:
+    """Request, throttle and latency counters since the process started."""
+    with _stats_lock:
+        stats = dict(_stats)
+    total = stats.pop("latency_total_s")
+    answered = stats["requests"] - stats["throttled"] - stats["errors"]
+    stats["latency_avg_ms"] = round(1000 * total / answered, 1) if answered else None
+    stats["latency_max_ms"] = round(1000 * stats.pop("latency_max_s"), 1)
+    stats["tps_limit"] = PAAPI_TPS
+    return stats
+
+
 def _get_client():
     """
-    Build and cache the PA-API client.
+    Build and cache the PA-API client (one per credential set).
     Returns None if keys are missing or library is not installed.
     """
     if AmazonApi is None:
@@ -29,36 +161,98 @@ def _get_client():
         logger.error("PA-API keys or tag missing in environment. Autofill disabled.")
         return None
 
-    try:
-        client = AmazonApi(
+    key = (access_key, secret_key, partner_tag, region)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is not None:
+            return client
+
+        kwargs = dict(
             access_key=access_key,
             secret_key=secret_key,
             partner_tag=partner_tag,
             partner_type="Associates",
             region=region,
         )
+        try:
+            try:
+                # We rate-limit ourselves; turn off the wrapper's own sleep
+                client = AmazonApi(throttling=0, **kwargs)
+            except TypeError:
+                client = AmazonApi(**kwargs)
+        except Exception as e:
+            logger.error(f"Failed to initialize AmazonApi client: {e}")
+            return None
+
+        _clients[key] = client
         return client
-    except Exception as e:
-        logger.error(f"Failed to initialize AmazonApi client: {e}")
-        return None
 
 
-def fetch_product_data(asin: str) -> dict:
-    """
-    Call PA-API for a single ASIN and return normalized product data:
-    {
-        "asin": str,
-        "title": str,
-        "image": str,
-        "price": str,      # like "$29.99"
-        "reg_price": str,  # like "$49.99" or ""
-        "promo": {
-            "has_promo": bool,
-            "promo_text": str
-        }
-    }
-    """
-    base = {
+# Only what _parse_item reads; the wrapper's default asks for every
+# resource (reviews, browse nodes, variants, all listings...)
+PAAPI_RESOURCES = [
+    "ItemInfo.Title",
+    "ItemInfo.ProductInfo",
+    "Images.Primary.Large",
+    "Offers.Listings.Price",
+]
+
+# False once the wrapper has rejected the `resources` argument
+_resources_supported = True
+
+
+def _request_items(client, asins):
+    global _resources_supported
+    if _resources_supported:
+        try:
+            return client.get_items(asins, resources=PAAPI_RESOURCES)
+        except TypeError:
+            logger.warning("PA-API wrapper does not accept resources=; using its default set")
+            _resources_supported = False
+    return client.get_items(asins)
+
+
+def _is_throttled(exc) -> bool:
+    name = type(exc).__name__.lower()
+    if "toomanyrequests" in name or "throttl" in name:
+        return True
+    text = str(exc).lower()
+    return "toomanyrequests" in text or "too many requests" in text or "throttl" in text
+
+
+def _get_items(client, asins):
+    """client.get_items() under the TPS limit, retrying throttled calls."""
+    for attempt in range(PAAPI_MAX_RETRIES + 1):
+        _limiter.acquire()
+        started = time.monotonic()
+        try:
+            resp = _request_items(client, asins)
+        except Exception as e:
+            if not _is_throttled(e):
+                _count(requests=1, errors=1)
+                raise
+            _count(requests=1, throttled=1)
+            if attempt == PAAPI_MAX_RETRIES:
+                raise
+            delay = random.uniform(0.5, 1.5) * PAAPI_RETRY_BASE * 2 ** attempt
+            logger.warning(f"PA-API throttled; retrying in {delay:.1f}s")
+            _count(retries=1)
+            time.sleep(delay)
+            continue
+
+        elapsed = time.monotonic() - started
+        _count(requests=1, items_requested=len(asins), latency_total_s=elapsed)
+        with _stats_lock:
+            _stats["latency_max_s"] = max(_stats["latency_max_s"], elapsed)
+        return resp
+
+
+# PA-API GetItems accepts at most this many ASINs per request
+MAX_ITEMS_PER_REQUEST = 10
+
+
+def _empty_product(asin: str) -> dict:
+    return {
         "asin": asin or "",
         "title": "",
         "image": "",
@@ -70,102 +264,163 @@ def fetch_product_data(asin: str) -> dict:
         }
     }
 
-    if not asin:
-        logger.warning("fetch_product_data called with empty ASIN.")
-        return base
 
-    client = _get_client()
-    if client is None:
-        return base
+def _response_items(resp) -> list:
+    """Items of a GetItems response: dict (PA-API v5 JSON), list, or wrapper object."""
+    if isinstance(resp, dict):
+        return resp.get("ItemsResult", {}).get("Items", []) or []
+    if isinstance(resp, (list, tuple)):
+        return list(resp)
+    # Some wrappers may return a list-like
+    return list(getattr(resp, "items", None) or getattr(resp, "Items", None) or [])
 
-    try:
-        resp = client.get_items(asin)
-    except Exception as e:
-        logger.error(f"PA-API get_items failed for {asin}: {e}")
-        return base
 
-    try:
-        # Assume PA-API v5-like structure via wrapper
-        if isinstance(resp, dict):
-            items_result = resp.get("ItemsResult", {})
-            items = items_result.get("Items", [])
-            item = items[0] if items else None
-        else:
-            # Some wrappers may return a list-like
-            items = getattr(resp, "items", None) or getattr(resp, "Items", None) or []
-            item = items[0] if items else None
-
-        if not item:
-            logger.warning(f"No item found in PA-API response for ASIN {asin}")
-            return base
-
-        # TITLE
-        title = (
-            item.get("ItemInfo", {})
-                .get("Title", {})
-                .get("DisplayValue", "")
-        )
+def _item_asin(item) -> str:
+    if isinstance(item, dict):
+        return item.get("ASIN") or item.get("asin") or ""
+    return getattr(item, "asin", None) or getattr(item, "ASIN", None) or ""
+
+
+def _money(amount) -> str:
+    if isinstance(amount, (int, float)):
+        return f"${amount:.2f}"
+    if amount is not None:
+        return str(amount)
+    return ""
 
-        # IMAGE
-        image = (
-            item.get("Images", {})
-                .get("Primary", {})
-                .get("Large", {})
-                .get("URL", "")
-        )
 
-        # PRICE & REGULAR PRICE
-        offer = (item.get("Offers") or {}).get("Listings", [{}])[0]
-        price_info = offer.get("Price", {}) or {}
-        price_amount = price_info.get("Amount")
-        list_price_amount = (
-            item.get("ItemInfo", {})
-                .get("ProductInfo", {})
-                .get("ListPrice", {})
-                .get("Amount")
+class PaItem:
+    """The few fields autofill reads from a PA-API item, pulled out in one pass."""
+
+    __slots__ = ("asin", "title", "image", "price", "list_price", "savings_percent", "coupon_label")
+
+    def __init__(self, asin="", title="", image="", price=None, list_price=None,
+                 savings_percent=None, coupon_label=None):
+        self.asin = asin
+        self.title = title
+        self.image = image
+        self.price = price
+        self.list_price = list_price
+        self.savings_percent = savings_percent
+        self.coupon_label = coupon_label
+
+    @classmethod
+    def from_item(cls, item: dict) -> "PaItem":
+        info = item.get("ItemInfo") or {}
+        images = item.get("Images") or {}
+        listings = (item.get("Offers") or {}).get("Listings") or [{}]
+        offer = listings[0] if isinstance(listings[0], dict) else {}
+        price_info = offer.get("Price") or {}
+
+        coupon = offer.get("Coupon")
+        coupon_label = None
+        if coupon:
+            coupon_label = coupon.get("CouponLabel") or coupon.get("BadgeText") or "Coupon available"
+
+        return cls(
+            asin=item.get("ASIN") or "",
+            title=(info.get("Title") or {}).get("DisplayValue") or "",
+            image=((images.get("Primary") or {}).get("Large") or {}).get("URL") or "",
+            price=price_info.get("Amount"),
+            list_price=((info.get("ProductInfo") or {}).get("ListPrice") or {}).get("Amount"),
+            savings_percent=(price_info.get("Savings") or {}).get("Percentage"),
+            coupon_label=coupon_label,
         )
 
-        price_str = ""
-        if isinstance(price_amount, (int, float)):
-            price_str = f"${price_amount:.2f}"
-        elif price_amount is not None:
-            price_str = str(price_amount)
-
-        reg_str = ""
-        if isinstance(list_price_amount, (int, float)):
-            reg_str = f"${list_price_amount:.2f}"
-        elif list_price_amount is not None:
-            reg_str = str(list_price_amount)
-
-        # PROMO / SAVINGS
-        savings = price_info.get("Savings", {}) or {}
-        percent = savings.get("Percentage")
-        has_promo = False
+    def to_product(self, asin: str) -> dict:
+        """The fetch_product_data() dict for this item."""
         promo_text = ""
-
+        percent = self.savings_percent
         if isinstance(percent, (int, float)) and percent > 0:
-            has_promo = True
             promo_text = f"Save {int(percent)}% Today!"
+        elif self.coupon_label:
+            promo_text = self.coupon_label
 
-        # Some wrappers may expose coupon info
-        coupon = offer.get("Coupon") if isinstance(offer, dict) else None
-        if coupon and not promo_text:
-            label = coupon.get("CouponLabel") or coupon.get("BadgeText") or "Coupon available"
-            has_promo = True
-            promo_text = label
-
-        base.update({
-            "title": title or "",
-            "image": image or "",
-            "price": price_str,
-            "reg_price": reg_str,
+        product = _empty_product(asin)
+        product.update({
+            "title": self.title,
+            "image": self.image,
+            "price": _money(self.price),
+            "reg_price": _money(self.list_price),
             "promo": {
-                "has_promo": bool(has_promo),
-                "promo_text": promo_text or ""
+                "has_promo": bool(promo_text),
+                "promo_text": promo_text
             }
         })
-        return base
+        return product
+
 
+def _parse_item(item, asin: str) -> dict:
+    """Normalize one PA-API item into the fetch_product_data() dict."""
+    try:
+        return PaItem.from_item(item).to_product(asin)
     except Exception as e:
         logger.error(f"Error parsing PA-API response for ASIN {asin}: {e}")
-        return base
+        return _empty_product(asin)
+
+
+def fetch_product_data_many(asins) -> dict:
+    """
+    Batch version of fetch_product_data(): {asin: product data} for every
+    non-empty ASIN given. Duplicates are looked up once and ASINs go out
+    MAX_ITEMS_PER_REQUEST per GetItems call. ASINs that fail or are not
+    returned map to empty product data, like fetch_product_data().
+    """
+    unique = list(dict.fromkeys(a for a in asins if a))
+    results = {asin: _empty_product(asin) for asin in unique}
+    if not unique:
+        return results
+
+    client = _get_client()
+    if client is None:
+        return results
+
+    for start in range(0, len(unique), MAX_ITEMS_PER_REQUEST):
+        batch = unique[start:start + MAX_ITEMS_PER_REQUEST]
+        try:
+            resp = _get_items(client, batch)
+        except Exception as e:
+            logger.error(f"PA-API get_items failed for {', '.join(batch)}: {e}")
+            continue
+
+        try:
+            items = _response_items(resp)
+        except Exception as e:
+            logger.error(f"Error parsing PA-API response for {', '.join(batch)}: {e}")
+            continue
+
+        by_asin = {_item_asin(item).upper(): item for item in items if item}
+        if len(batch) == 1 and len(items) == 1 and not by_asin.get(batch[0].upper()):
+            # response without ASIN fields: the single item is ours
+            by_asin = {batch[0].upper(): items[0]}
+
+        for asin in batch:
+            item = by_asin.get(asin.upper())
+            if item is None:
+                logger.warning(f"No item found in PA-API response for ASIN {asin}")
+                continue
+            results[asin] = _parse_item(item, asin)
+
+    return results
+
+
+def fetch_product_data(asin: str) -> dict:
+    """
+    Call PA-API for a single ASIN and return normalized product data:
+    {
+        "asin": str,
+        "title": str,
+        "image": str,
+        "price": str,      # like "$29.99"
+        "reg_price": str,  # like "$49.99" or ""
+        "promo": {
+            "has_promo": bool,
+            "promo_text": str
+        }
+    }
+    """
+    if not asin:
+        logger.warning("fetch_product_data called with empty ASIN.")
+        return _empty_product(asin)
+
+    return fetch_product_data_many([asin])[asin]
@@ -0,0 +1,97 @@
+# autofill/product_cache.py
+#
+# Persistent ASIN -> product data cache in front of get_product_data.
+# Fields are cached in groups with their own TTL, since titles/images
+# barely change, prices change daily and promos change hourly. A group
+# past its TTL is refreshed on its own; fresh groups are served from here.
+
+import os
+import json
+import time
+import logging
+
+from modules.local_store import LocalStore
+
+logger = logging.getLogger(__name__)
+
+# group -> fields of the get_product_data() dict it covers
+GROUPS = {
+    "info": ("title", "image"),
+    "price": ("price", "reg_price"),
+    "promo": ("promo", "promo_code"),
+}
+
+# Seconds each group stays fresh (0 = never cached)
+TTLS = {
+    "info": int(os.getenv("PRODUCT_CACHE_INFO_TTL", str(7 * 24 * 3600))),
+    "price": int(os.getenv("PRODUCT_CACHE_PRICE_TTL", str(6 * 3600))),
+    "promo": int(os.getenv("PRODUCT_CACHE_PROMO_TTL", "3600")),
+}
+
+_store = LocalStore("product_cache.sqlite3", """
+CREATE TABLE IF NOT EXISTS product_cache (
+    asin       TEXT NOT NULL,
+    field_group TEXT NOT NULL,
+    data       TEXT NOT NULL,
+    fetched_at REAL NOT NULL,
+    PRIMARY KEY (asin, field_group)
+);
+""")
+
+
+def lookup(asin):
+    """{group: {field: value}} for the groups of `asin` that are still fresh."""
+    if not asin:
+        return {}
+    try:
+        rows = _store.query(
+            "SELECT field_group, data, fetched_at FROM product_cache WHERE asin = ?",
+            (asin,),
+        )
+    except Exception as e:
+        logger.warning(f"Product cache unavailable: {e}")
+        return {}
+
+    now = time.time()
+    fresh = {}
+    for group, data, fetched_at in rows:
+        if group in TTLS and now - fetched_at < TTLS[group]:
+            fresh[group] = json.loads(data)
+    return fresh
+
+
+def stale_groups(fresh):
+    """Groups missing from `fresh` (a lookup() result): they have to be fetched again."""
+    return [group for group in GROUPS if group not in fresh]
+
+
+def store(asin, product, groups):
+    """
+    Cache `groups` of a freshly fetched product. Groups that came back
+    empty (failed lookup) are not cached, so the next run tries again.
+    """
+    if not asin:
+        return
+
+    found = bool(product.get("title") or product.get("price"))
+    keep = {
+        "info": bool(product.get("title") or product.get("image")),
+        "price": bool(product.get("price")),
+        "promo": found,
+    }
+
+    now = time.time()
+    rows = [
+        (asin, group, json.dumps({f: product.get(f) for f in GROUPS[group]}, ensure_ascii=False), now)
+        for group in groups
+        if keep.get(group) and TTLS.get(group)
+    ]
+    if not rows:
+        return
+    try:
+        _store.executemany(
+            "INSERT OR REPLACE INTO product_cache (asin, field_group, data, fetched_at) VALUES (?, ?, ?, ?)",
+            rows,
+        )
+    except Exception as e:
+        logger.warning(f"Failed to cache product {asin}: {e}")
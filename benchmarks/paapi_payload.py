@@ -0,0 +1,92 @@
+# benchmarks/paapi_payload.py
+#
+# Payload size and parse time of a 10-item GetItems response with the
+# wrapper's default (full) resource set vs. the minimal PAAPI_RESOURCES
+# list that autofill now requests. The slim response is derived from the
+# full fixture by keeping only the requested resource paths, which is
+# what PA-API returns for them.
+#
+#   python benchmarks/paapi_payload.py [--repeat 2000]
+
+import os
+import sys
+import json
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from autofill.paapi_autofill import PAAPI_RESOURCES, _response_items, _parse_item
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "paapi_get_items_full.json")
+
+# Always present in an item, whatever resources were asked for
+ITEM_KEYS = ("ASIN", "DetailPageURL", "ParentASIN")
+
+
+def _copy_path(src, dst, parts):
+    """Copy src[parts...] into dst; lists (e.g. Listings) apply to every element."""
+    if not isinstance(src, dict) or parts[0] not in src:
+        return
+    key, rest = parts[0], parts[1:]
+    value = src[key]
+    if not rest:
+        dst[key] = value
+    elif isinstance(value, list):
+        out = dst.setdefault(key, [{} for _ in value])
+        for s, d in zip(value, out):
+            _copy_path(s, d, rest)
+    else:
+        _copy_path(value, dst.setdefault(key, {}), rest)
+
+
+def slim_response(full, resources):
+    items = []
+    for item in full["ItemsResult"]["Items"]:
+        slim = {k: item[k] for k in ITEM_KEYS if k in item}
+        for resource in resources:
+            _copy_path(item, slim, resource.split("."))
+        items.append(slim)
+    return {"ItemsResult": {"Items": items}}
+
+
+def parse(raw):
+    resp = json.loads(raw)
+    return [_parse_item(item, item.get("ASIN", "")) for item in _response_items(resp)]
+
+
+def timed(raw, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        parse(raw)
+    return (time.perf_counter() - started) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PA-API full vs. slim payload benchmark")
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+
+    with open(FIXTURE, encoding="utf-8") as f:
+        full = json.load(f)
+    slim = slim_response(full, PAAPI_RESOURCES)
+
+    full_raw = json.dumps(full, separators=(",", ":"))
+    slim_raw = json.dumps(slim, separators=(",", ":"))
+
+    # Same products either way
+    assert parse(full_raw) == parse(slim_raw), "slim response parses differently"
+
+    full_s = timed(full_raw, args.repeat)
+    slim_s = timed(slim_raw, args.repeat)
+    items = len(full["ItemsResult"]["Items"])
+
+    print(f"Resources: {', '.join(PAAPI_RESOURCES)}")
+    print(f"{'':8}{'bytes':>10}{'parse ms':>12}   ({items} items, {args.repeat} runs)")
+    print(f"{'full':8}{len(full_raw):>10}{full_s * 1000:>12.3f}")
+    print(f"{'slim':8}{len(slim_raw):>10}{slim_s * 1000:>12.3f}")
+    print(f"{'saved':8}{1 - len(slim_raw) / len(full_raw):>10.0%}{1 - slim_s / full_s:>12.0%}")
+
+
+if __name__ == "__main__":
+    main()
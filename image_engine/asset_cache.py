@@ -0,0 +1,69 @@
+# image_engine/asset_cache.py
+#
+# Process-wide cache of the static inputs of every render: TrueType fonts
+# and the pre-scaled RGBA overlays (Black Friday, link badge). They are
+# loaded once and reused until the file on disk changes (mtime).
+
+import os
+import threading
+from PIL import Image
+
+from image_engine.composer_utils import load_font
+
+_lock = threading.Lock()
+_fonts = {}     # (name, size) -> (mtime, font)
+_overlays = {}  # (path, scale) -> (mtime, RGBA image or None)
+
+
+def _mtime(path):
+    # Fonts given by bare name ("arial.ttf") are resolved by FreeType from
+    # the system font dirs; those have no local mtime and never go stale.
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return None
+
+
+def get_font(name, size):
+    """ImageFont for (name, size); load_default() if it can't be loaded."""
+    key = (name, size)
+    mtime = _mtime(name)
+    with _lock:
+        hit = _fonts.get(key)
+    if hit and hit[0] == mtime:
+        return hit[1]
+
+    font = load_font(name, size)
+    with _lock:
+        _fonts[key] = (mtime, font)
+    return font
+
+
+def get_overlay(path, scale=1.0):
+    """
+    RGBA image at `path`, LANCZOS-resized by `scale`, or None if the file
+    does not exist. Callers paste it and must not modify it.
+    """
+    key = (path, scale)
+    mtime = _mtime(path)
+    with _lock:
+        hit = _overlays.get(key)
+    if hit and hit[0] == mtime:
+        return hit[1]
+
+    overlay = None
+    if mtime is not None:
+        overlay = Image.open(path).convert("RGBA")
+        if scale != 1.0:
+            overlay = overlay.resize(
+                (int(overlay.width * scale), int(overlay.height * scale)), Image.LANCZOS
+            )
+    with _lock:
+        _overlays[key] = (mtime, overlay)
+    return overlay
+
+
+def clear():
+    with _lock:
+        _fonts.clear()
+        _overlays.clear()
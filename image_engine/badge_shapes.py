@@ -1,36 +1,64 @@
 # modules/badge_shapes.py
-from PIL import ImageDraw
+import math
+import threading
+from collections import OrderedDict
+from PIL import Image, ImageDraw
 
-# Shape generator for future expansion
-def get_polygon_for_shape(shape_type, x, y, size):
-    if shape_type.lower() == "circle":
-        cx = x + size // 2
-        cy = y + size // 2
-        return ("circle", (cx, cy, size // 2))
-
-    if shape_type.lower() == "starburst_15":
-        center_x = x + size // 2
-        center_y = y + size // 2
-        points = []
-        import math
-        for i in range(30):  # 15 spikes → 30 points
-            angle = (i / 30) * 2 * math.pi
-            r = size * 0.5 if i % 2 == 0 else size * 0.35
-            px = center_x + r * math.cos(angle)
-            py = center_y + r * math.sin(angle)
-            points.append((px, py))
-        return ("polygon", points)
-
-    if shape_type.lower() == "none":
-        # No shape → Only text
-        return ("none", None)
-
-    # Default to circle
+# Sprites are drawn this many times larger, then downsampled (antialiasing)
+SUPERSAMPLE = 4
+# Max (shape, color, size) sprites kept in memory
+MAX_SPRITES = 256
+
+
+# ---------------------------
+# SHAPE REGISTRY
+# ---------------------------
+# name -> geometry(x, y, size) returning ("circle", (cx, cy, r)),
+# ("polygon", [(x, y), ...]) or ("none", None)
+SHAPES = {}
+
+
+def register_shape(name, geometry):
+    """Make a badge shape selectable through the BADGE column."""
+    SHAPES[name.lower()] = geometry
+
+
+def _circle(x, y, size):
     cx = x + size // 2
     cy = y + size // 2
     return ("circle", (cx, cy, size // 2))
 
 
+def _starburst_15(x, y, size):
+    center_x = x + size // 2
+    center_y = y + size // 2
+    points = []
+    for i in range(30):  # 15 spikes → 30 points
+        angle = (i / 30) * 2 * math.pi
+        r = size * 0.5 if i % 2 == 0 else size * 0.35
+        px = center_x + r * math.cos(angle)
+        py = center_y + r * math.sin(angle)
+        points.append((px, py))
+    return ("polygon", points)
+
+
+def _none(x, y, size):
+    # No shape → Only text
+    return ("none", None)
+
+
+register_shape("circle", _circle)
+register_shape("starburst_15", _starburst_15)
+register_shape("none", _none)
+
+
+# Shape generator for future expansion
+def get_polygon_for_shape(shape_type, x, y, size):
+    # Unknown shapes default to circle
+    geometry = SHAPES.get(shape_type.lower(), _circle)
+    return geometry(x, y, size)
+
+
 def draw_shape(draw: ImageDraw.Draw, shape_type, fill_color, x, y, size):
     shape, data = get_polygon_for_shape(shape_type, x, y, size)
 
@@ -44,3 +72,51 @@ def draw_shape(draw: ImageDraw.Draw, shape_type, fill_color, x, y, size):
     elif shape == "none":
         # Do nothing
         pass
+
+
+# ---------------------------
+# BADGE SPRITES
+# ---------------------------
+_sprites = OrderedDict()  # (shape, color, size) -> RGBA sprite or None
+_sprites_lock = threading.Lock()
+
+
+def _render_sprite(shape_type, fill_color, size):
+    big = size * SUPERSAMPLE
+    shape, data = get_polygon_for_shape(shape_type, 0, 0, big)
+    if shape == "none":
+        return None
+
+    mask = Image.new("L", (big, big), 0)
+    draw_shape(ImageDraw.Draw(mask), shape_type, 255, 0, 0, big)
+    mask = mask.resize((size, size), Image.LANCZOS)
+
+    sprite = Image.new("RGBA", (size, size), fill_color)
+    sprite.putalpha(mask)
+    return sprite
+
+
+def get_badge_sprite(shape_type, fill_color, size):
+    """
+    Antialiased RGBA sprite of the badge, rendered once per
+    (shape, color, size). None for the "none" shape.
+    """
+    key = (shape_type.lower(), fill_color, size)
+    with _sprites_lock:
+        if key in _sprites:
+            _sprites.move_to_end(key)
+            return _sprites[key]
+
+    sprite = _render_sprite(*key)
+    with _sprites_lock:
+        _sprites[key] = sprite
+        while len(_sprites) > MAX_SPRITES:
+            _sprites.popitem(last=False)
+    return sprite
+
+
+def paste_badge(canvas, shape_type, fill_color, x, y, size):
+    """Alpha-paste the cached badge sprite onto the canvas at (x, y)."""
+    sprite = get_badge_sprite(shape_type, fill_color, size)
+    if sprite is not None:
+        canvas.paste(sprite, (x, y), sprite)
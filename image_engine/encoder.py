@@ -0,0 +1,87 @@
+# image_engine/encoder.py
+#
+# Output encoding for rendered images. Every render is uploaded to
+# FreeImage and then pulled by each viewer, so format, quality and an
+# optional byte budget are configurable here (env). The defaults give the
+# same JPEG (quality 75) the composer has always written.
+
+import io
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+# jpeg | pjpeg (progressive JPEG) | webp
+OUTPUT_FORMAT = os.getenv("IMAGE_OUTPUT_FORMAT", "jpeg").strip().lower()
+OUTPUT_QUALITY = int(os.getenv("IMAGE_OUTPUT_QUALITY", "75"))
+# JPEG chroma subsampling: "4:4:4", "4:2:2", "4:2:0"; empty = Pillow default
+OUTPUT_SUBSAMPLING = os.getenv("IMAGE_OUTPUT_SUBSAMPLING", "").strip()
+# Largest encoded size wanted, in bytes (0 = no budget). Quality is lowered
+# as needed, but never below OUTPUT_MIN_QUALITY.
+OUTPUT_MAX_BYTES = int(os.getenv("IMAGE_OUTPUT_MAX_BYTES", "0"))
+OUTPUT_MIN_QUALITY = int(os.getenv("IMAGE_OUTPUT_MIN_QUALITY", "40"))
+# Encodes tried by the budget search (binary search over quality)
+BUDGET_STEPS = 6
+
+FORMATS = {
+    "jpeg":  {"pil": "JPEG", "ext": "jpg",  "mime": "image/jpeg", "options": {}},
+    "pjpeg": {"pil": "JPEG", "ext": "jpg",  "mime": "image/jpeg",
+              "options": {"progressive": True, "optimize": True}},
+    "webp":  {"pil": "WEBP", "ext": "webp", "mime": "image/webp", "options": {"method": 4}},
+}
+
+
+def output_format(fmt=None):
+    """{"ext", "mime", ...} of the configured (or given) output format."""
+    name = (fmt or OUTPUT_FORMAT).lower()
+    if name not in FORMATS:
+        logger.error(f"Unknown IMAGE_OUTPUT_FORMAT {name!r}; using jpeg")
+        name = "jpeg"
+    return FORMATS[name]
+
+
+def _encode(canvas, spec, quality, subsampling):
+    options = dict(spec["options"], quality=quality)
+    if subsampling and spec["pil"] == "JPEG":
+        options["subsampling"] = subsampling
+
+    buf = io.BytesIO()
+    canvas.save(buf, format=spec["pil"], **options)
+    return buf.getvalue()
+
+
+def encode_image(canvas, fmt=None, quality=None, subsampling=None, max_bytes=None):
+    """
+    Encode a PIL image with the output settings; returns bytes.
+
+    With a byte budget, the highest quality between OUTPUT_MIN_QUALITY
+    and `quality` that fits is found by bisection (bounded by
+    BUDGET_STEPS encodes). If even the minimum does not fit, the minimum
+    quality encode is returned.
+    """
+    spec = output_format(fmt)
+    quality = OUTPUT_QUALITY if quality is None else quality
+    subsampling = OUTPUT_SUBSAMPLING if subsampling is None else subsampling
+    max_bytes = OUTPUT_MAX_BYTES if max_bytes is None else max_bytes
+
+    data = _encode(canvas, spec, quality, subsampling)
+    if not max_bytes or len(data) <= max_bytes:
+        return data
+
+    floor = min(OUTPUT_MIN_QUALITY, quality)
+    best = _encode(canvas, spec, floor, subsampling)
+    if len(best) > max_bytes:
+        logger.warning(f"Render is {len(best)} bytes at quality {floor}; budget is {max_bytes}")
+        return best
+
+    lo, hi = floor + 1, quality - 1
+    for _ in range(BUDGET_STEPS):
+        if lo > hi:
+            break
+        q = (lo + hi) // 2
+        attempt = _encode(canvas, spec, q, subsampling)
+        if len(attempt) <= max_bytes:
+            best, lo = attempt, q + 1
+        else:
+            hi = q - 1
+    return best
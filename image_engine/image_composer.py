@@ -1,8 +1,14 @@
 # modules/image_composer.py
 
+import io
 import os
-from PIL import Image, ImageDraw, ImageFont
-from image_engine.badge_shapes import draw_shape
+import math
+import threading
+from PIL import Image, ImageDraw
+from image_engine.badge_shapes import paste_badge
+from image_engine.asset_cache import get_font, get_overlay
+from image_engine.text_layout import layout_price
+from image_engine.encoder import encode_image, output_format
 
 # ---------------------------
 # SIZES
@@ -20,8 +26,18 @@ BACKGROUND_COLOR = (255, 255, 255)
 MARGIN = 40
 
 LINK_BADGE_PATH = "images/link.png"
+LINK_BADGE_SCALE = 1.6
 BLACK_FRIDAY_PATH = "images/black_friday.png"
+BLACK_FRIDAY_SCALE = 0.30
 DISCLAIMER_TEXT = "*Prices are subject to change at any time."
+DISCLAIMER_FONT = "arial.ttf"
+DISCLAIMER_FONT_SIZE = 24
+
+# Product image is fitted into this box (70% of the canvas)
+PRODUCT_BOX = (int(CANVAS_SIZE[0] * 0.7), int(CANVAS_SIZE[1] * 0.7))
+# Sources with more pixels than this are refused before decoding
+# (decompression bombs: a few MB of PNG/JPEG can claim gigapixels)
+MAX_SOURCE_PIXELS = int(os.getenv("MAX_SOURCE_PIXELS", "40000000"))
 
 
 # ---------------------------
@@ -44,57 +60,112 @@ def get_contrast_color(hex_color):
 
 
 # ---------------------------
-# SPLIT PRICE INTO 1–2 LINES
+# SOURCE IMAGE
+# ---------------------------
+def open_source(source):
+    """Open a product image given as a path, raw bytes, file object or PIL image."""
+    if isinstance(source, Image.Image):
+        return source
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return Image.open(io.BytesIO(source))
+    return Image.open(source)
+
+
+def load_product(source, box=PRODUCT_BOX):
+    """
+    Decode the product image fitted into `box` (RGB). Only the header is
+    read before the pixel budget check; JPEGs are then decoded directly
+    at the smallest 1/2, 1/4 or 1/8 scale that is still at least the
+    final thumbnail size (draft mode), instead of at full resolution.
+    """
+    img = open_source(source)
+    w, h = img.size
+    if w * h > MAX_SOURCE_PIXELS:
+        raise ValueError(f"Source image too large ({w}x{h} px, limit {MAX_SOURCE_PIXELS})")
+
+    ratio = min(box[0] / w, box[1] / h)
+    if ratio < 1:
+        img.draft("RGB", (math.ceil(w * ratio), math.ceil(h * ratio)))
+
+    product = img.convert("RGB")
+    product.thumbnail(box)
+    return product
+
+
+# ---------------------------
+# STATIC BASE TEMPLATE
 # ---------------------------
-def split_two_lines(draw, text, font, max_width):
-    words = text.split()
-    lines = []
-    current = ""
+_templates = {}  # layout config -> (overlay, font, canvas)
+_templates_lock = threading.Lock()
+
+
+def base_template():
+    """
+    White canvas with the Black Friday overlay and the disclaimer, i.e.
+    everything that is the same for every row. Built once per layout
+    config (and again if an asset changes); callers must copy() it.
+    """
+    bf = get_overlay(BLACK_FRIDAY_PATH, BLACK_FRIDAY_SCALE)
+    font = get_font(DISCLAIMER_FONT, DISCLAIMER_FONT_SIZE)
+    key = (
+        CANVAS_SIZE, BACKGROUND_COLOR, MARGIN,
+        BLACK_FRIDAY_PATH, BLACK_FRIDAY_SCALE,
+        DISCLAIMER_TEXT, DISCLAIMER_FONT, DISCLAIMER_FONT_SIZE,
+    )
+    with _templates_lock:
+        hit = _templates.get(key)
+    if hit and hit[0] is bf and hit[1] is font:
+        return hit[2]
 
-    for w in words:
-        test = (current + " " + w).strip()
-        if draw.textlength(test, font=font) <= max_width:
-            current = test
-        else:
-            if current:
-                lines.append(current)
-            current = w
-        if len(lines) == 2:
-            break
+    canvas = Image.new("RGB", CANVAS_SIZE, BACKGROUND_COLOR)
 
-    if current and len(lines) < 2:
-        lines.append(current)
+    # Black Friday badge small top-left
+    if bf is not None:
+        canvas.paste(bf, (MARGIN, MARGIN), bf)
+
+    # Disclaimer bottom-right
+    draw = ImageDraw.Draw(canvas)
+    dw = draw.textlength(DISCLAIMER_TEXT, font=font)
+    draw.text(
+        (CANVAS_SIZE[0] - dw - MARGIN, CANVAS_SIZE[1] - 50),
+        DISCLAIMER_TEXT, fill="#777", font=font
+    )
 
-    return lines[:2]
+    with _templates_lock:
+        _templates[key] = (bf, font, canvas)
+    return canvas
+
+
+def warm_caches():
+    """Load fonts, overlays and the base template ahead of the first render."""
+    get_font("arialbd.ttf", PRICE_FONT)
+    get_font("arialbd.ttf", PRICE_FONT_SMALL)
+    get_font("arial.ttf", REG_FONT)
+    get_overlay(LINK_BADGE_PATH, LINK_BADGE_SCALE)
+    base_template()
 
 
 # ---------------------------
 # MAIN FUNCTION
 # ---------------------------
-def compose_image(
-    image_path: str,
+def render_base(
+    source,
     price_text: str,
     badge_type: str = "circle",
     badge_color: str = "#FF0000",
-    include_link: bool = True,
     reg_text: str = "",
-    output_path: str = None
 ):
+    """
+    Build the layers every variant shares (base template, product,
+    badge, price) and return the 1080x1080 canvas (PIL, RGB).
+    """
 
-    # canvas
-    canvas = Image.new("RGB", CANVAS_SIZE, BACKGROUND_COLOR)
+    # canvas: static layers (Black Friday, disclaimer) come pre-rendered
+    canvas = base_template().copy()
     draw = ImageDraw.Draw(canvas)
 
-    # Black Friday badge small top-left
-    if os.path.exists(BLACK_FRIDAY_PATH):
-        bf = Image.open(BLACK_FRIDAY_PATH).convert("RGBA")
-        scale = 0.30
-        bf = bf.resize((int(bf.width * scale), int(bf.height * scale)), Image.LANCZOS)
-        canvas.paste(bf, (MARGIN, MARGIN), bf)
-
     # Product image
-    product = Image.open(image_path).convert("RGB")
-    product.thumbnail((CANVAS_SIZE[0] * 0.7, CANVAS_SIZE[1] * 0.7))
+    product = load_product(source)
 
     px = (CANVAS_SIZE[0] - product.width) // 2
     py = (CANVAS_SIZE[1] - product.height) // 2
@@ -104,15 +175,10 @@ def compose_image(
     bx = CANVAS_SIZE[0] - BADGE_SIZE - MARGIN
     by = MARGIN
 
-    # Load fonts
-    try:
-        font_big = ImageFont.truetype("arialbd.ttf", PRICE_FONT)
-        font_small = ImageFont.truetype("arialbd.ttf", PRICE_FONT_SMALL)
-        font_reg = ImageFont.truetype("arial.ttf", REG_FONT)
-    except:
-        font_big = ImageFont.load_default()
-        font_small = ImageFont.load_default()
-        font_reg = ImageFont.load_default()
+    # Load fonts (cached per process)
+    font_big = get_font("arialbd.ttf", PRICE_FONT)
+    font_small = get_font("arialbd.ttf", PRICE_FONT_SMALL)
+    font_reg = get_font("arial.ttf", REG_FONT)
 
     # Text color logic
     if badge_type.lower() == "none":
@@ -120,93 +186,106 @@ def compose_image(
     else:
         text_color = get_contrast_color(badge_color)
 
-    # Price lines
-    max_w = BADGE_SIZE * 0.75
-    price_lines = split_two_lines(draw, price_text, font_big, max_w)
-    use_font = font_small if len(price_lines) == 2 else font_big
-
-    # ------------------------------
-    # CASE A → SHAPE PRESENT
-    # ------------------------------
+    # Price block layout (memoized per text, fonts and badge geometry)
     if badge_type.lower() != "none":
+        # badge shape (cached antialiased sprite)
+        paste_badge(canvas, badge_type.lower(), badge_color, bx, by, BADGE_SIZE)
+        anchor = ("center", bx, by, BADGE_SIZE)
+    else:
+        anchor = ("right", CANVAS_SIZE[0] - MARGIN, MARGIN)
 
-        # draw shape
-        draw_shape(draw, badge_type.lower(), badge_color, bx, by, BADGE_SIZE)
+    layout = layout_price(
+        price_text, reg_text, (font_big, font_small, font_reg),
+        BADGE_SIZE * 0.75, anchor, REG_FONT, LINE_SPACING,
+    )
 
-        # total height of block
-        height = sum(use_font.getbbox(x)[3] - use_font.getbbox(x)[1] for x in price_lines)
-        height += (len(price_lines) - 1) * LINE_SPACING
+    # PRICE
+    for x, y, line in layout["price"]:
+        draw.text((x, y), line, fill=text_color, font=layout["font"])
 
-        if reg_text.strip():
-            height += REG_FONT + LINE_SPACING
+    # REG + line-through
+    if layout["reg"]:
+        draw.text(layout["reg"], reg_text, fill="black", font=font_reg)
+        draw.line(layout["strike"], fill="black", width=3)
 
-        ty = by + (BADGE_SIZE - height) / 2
+    return canvas
 
-        # PRICE
-        for line in price_lines:
-            w = draw.textlength(line, font=use_font)
-            draw.text((bx + (BADGE_SIZE - w)/2, ty), line, fill=text_color, font=use_font)
-            ty += (use_font.getbbox(line)[3] - use_font.getbbox(line)[1]) + LINE_SPACING
 
-        # REG
-        if reg_text.strip():
-            w = draw.textlength(reg_text, font=font_reg)
-            rx = bx + (BADGE_SIZE - w) / 2
-            draw.text((rx, ty), reg_text, fill="black", font=font_reg)
+def add_link_badge(canvas):
+    """Paste the link badge bottom-left (EDITED variant only)."""
+    link = get_overlay(LINK_BADGE_PATH, LINK_BADGE_SCALE)
+    if link is not None:
+        canvas.paste(link, (20, CANVAS_SIZE[1] - link.height - 20), link)
+    return canvas
 
-            # line-through
-            draw.line(
-                (rx, ty + REG_FONT/2, rx + w, ty + REG_FONT/2),
-                fill="black", width=3
-            )
 
-    # ------------------------------
-    # CASE B → NO SHAPE
-    # ------------------------------
-    else:
+def render_canvas(
+    source,
+    price_text: str,
+    badge_type: str = "circle",
+    badge_color: str = "#FF0000",
+    include_link: bool = True,
+    reg_text: str = "",
+):
+    """Build the final 1080x1080 image in memory and return it (PIL, RGB)."""
+    canvas = render_base(source, price_text, badge_type, badge_color, reg_text)
+    if include_link:
+        add_link_badge(canvas)
+    return canvas
 
-        right_x = CANVAS_SIZE[0] - MARGIN
-        ty = MARGIN
 
-        # PRICE
-        for line in price_lines:
-            w = draw.textlength(line, font=use_font)
-            draw.text((right_x - w, ty), line, fill=text_color, font=use_font)
-            ty += use_font.getbbox(line)[3] - use_font.getbbox(line)[1] + LINE_SPACING
+# Output variants: name -> include the link badge?
+VARIANTS = {
+    "edited": True,      # EDITED_IMAGE
+    "pinterest": False,  # PINTREST_EDITED
+}
 
-        # REG
-        if reg_text.strip():
-            w = draw.textlength(reg_text, font=font_reg)
-            draw.text((right_x - w, ty), reg_text, fill="black", font=font_reg)
 
-            draw.line(
-                (right_x - w, ty + REG_FONT/2, right_x, ty + REG_FONT/2),
-                fill="black", width=3
-            )
+def render_variants(
+    source,
+    price_text: str,
+    badge_type: str = "circle",
+    badge_color: str = "#FF0000",
+    reg_text: str = "",
+    variants=("edited", "pinterest"),
+) -> dict:
+    """
+    Render several output variants from one decode of the source.
+    The shared canvas is built once; variants only differ by the link
+    badge layer. Returns {variant: encoded bytes} (see encoder.py).
+    """
+    base = render_base(source, price_text, badge_type, badge_color, reg_text)
+
+    out = {}
+    for name in variants:
+        canvas = add_link_badge(base.copy()) if VARIANTS[name] else base
+        out[name] = encode_image(canvas)
+    return out
 
-    # Disclaimer bottom-right
-    try:
-        small_font = ImageFont.truetype("arial.ttf", 24)
-    except:
-        small_font = ImageFont.load_default()
 
-    dw = draw.textlength(DISCLAIMER_TEXT, font=small_font)
-    draw.text(
-        (CANVAS_SIZE[0] - dw - MARGIN, CANVAS_SIZE[1] - 50),
-        DISCLAIMER_TEXT, fill="#777", font=small_font
+def compose_image(
+    image_path: str,
+    price_text: str,
+    badge_type: str = "circle",
+    badge_color: str = "#FF0000",
+    include_link: bool = True,
+    reg_text: str = "",
+    output_path: str = None
+):
+    canvas = render_canvas(
+        image_path,
+        price_text,
+        badge_type=badge_type,
+        badge_color=badge_color,
+        include_link=include_link,
+        reg_text=reg_text,
     )
 
-    # Link badge bottom-left
-    if include_link and os.path.exists(LINK_BADGE_PATH):
-        link = Image.open(LINK_BADGE_PATH).convert("RGBA")
-        scale = 1.6
-        link = link.resize((int(link.width * scale), int(link.height * scale)), Image.LANCZOS)
-        canvas.paste(link, (20, CANVAS_SIZE[1] - link.height - 20), link)
-
-    # Save result
+    # Save result (format from the output encoder settings)
     if output_path is None:
         base, ext = os.path.splitext(image_path)
-        output_path = f"{base}_final.jpg"
+        output_path = f"{base}_final.{output_format()['ext']}"
 
-    canvas.save(output_path)
+    with open(output_path, "wb") as f:
+        f.write(encode_image(canvas))
     return os.path.abspath(output_path)
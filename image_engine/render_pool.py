@@ -0,0 +1,77 @@
+# image_engine/render_pool.py
+#
+# Render backend for process_sheet. Rendering is pure Pillow CPU work; with
+# RENDER_BACKEND=process it runs in a pool of worker processes so it scales
+# with cores instead of sharing one GIL. Workers warm the font, overlay and
+# base template caches once at start-up and keep them for their lifetime.
+#
+# Sources cross the process boundary as the encoded image bytes (or a path
+# in disk mode) and results come back as encoded bytes, so no PIL objects
+# or decoded pixel buffers are ever pickled.
+
+import os
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from image_engine.image_composer import render_variants, warm_caches
+
+logger = logging.getLogger(__name__)
+
+# "thread": render on the calling thread; "process": worker process pool
+RENDER_BACKEND = os.getenv("RENDER_BACKEND", "thread").strip().lower()
+RENDER_PROCESSES = int(os.getenv("RENDER_PROCESSES", "0")) or os.cpu_count() or 1
+
+_pool = None
+_lock = threading.Lock()
+
+
+def _init_worker():
+    try:
+        warm_caches()
+    except Exception as e:
+        logger.warning(f"Render worker could not warm caches: {e}")
+
+
+def get_pool():
+    global _pool
+    with _lock:
+        if _pool is None:
+            logger.info(f"Starting render pool with {RENDER_PROCESSES} process(es)")
+            # spawn, not fork: the pool starts while pipeline, writer and
+            # lease threads hold locks a forked child could never release
+            _pool = ProcessPoolExecutor(
+                max_workers=RENDER_PROCESSES,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+            )
+        return _pool
+
+
+def _discard_pool(pool):
+    global _pool
+    with _lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False)
+
+
+def render(source, **kwargs):
+    """
+    render_variants() on the configured backend; same arguments and
+    result ({variant: encoded bytes}).
+    """
+    if RENDER_BACKEND != "process":
+        return render_variants(source, **kwargs)
+
+    pool = get_pool()
+    try:
+        return pool.submit(render_variants, source, **kwargs).result()
+    except BrokenProcessPool:
+        # a worker died (OOM, crash): start a fresh pool for the next row
+        logger.error("Render pool broke; it will be restarted")
+        _discard_pool(pool)
+        raise
+
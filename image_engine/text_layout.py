@@ -0,0 +1,89 @@
+# image_engine/text_layout.py
+#
+# Price/regular-price block layout for the badge. Line breaks, text
+# boxes and positions depend only on the strings, the fonts and the badge
+# geometry, and the same prices ("$19.99") repeat across a sheet, so
+# results are memoized in an LRU and shared by every variant and row.
+
+from functools import lru_cache
+
+LAYOUT_CACHE_SIZE = 1024
+
+
+def split_lines(text, font, max_width, max_lines=2):
+    """Greedy word wrap measured with font.getlength; at most max_lines."""
+    lines = []
+    current = ""
+
+    for w in text.split():
+        test = (current + " " + w).strip()
+        if font.getlength(test) <= max_width:
+            current = test
+        else:
+            if current:
+                lines.append(current)
+            current = w
+        if len(lines) == max_lines:
+            break
+
+    if current and len(lines) < max_lines:
+        lines.append(current)
+
+    return lines[:max_lines]
+
+
+def _line_height(font, line):
+    box = font.getbbox(line)
+    return box[3] - box[1]
+
+
+@lru_cache(maxsize=LAYOUT_CACHE_SIZE)
+def layout_price(price_text, reg_text, fonts, max_width, anchor, reg_height, line_spacing):
+    """
+    Place the price lines and the struck-through regular price.
+
+    fonts:  (font_big, font_small, font_reg); two price lines use font_small
+    anchor: ("center", x, y, size) -> block centred inside the badge box
+            ("right", right_x, top) -> block right-aligned at right_x
+
+    Returns {"font": price font, "price": ((x, y, line), ...),
+             "reg": (x, y) or None, "strike": (x0, y0, x1, y1) or None}.
+    The result is cached and shared; do not modify it.
+    """
+    font_big, font_small, font_reg = fonts
+
+    lines = split_lines(price_text, font_big, max_width)
+    use_font = font_small if len(lines) == 2 else font_big
+    heights = [_line_height(use_font, line) for line in lines]
+    has_reg = bool(reg_text.strip())
+
+    if anchor[0] == "center":
+        _, bx, by, size = anchor
+
+        # total height of block
+        height = sum(heights) + (len(lines) - 1) * line_spacing
+        if has_reg:
+            height += reg_height + line_spacing
+        ty = by + (size - height) / 2
+
+        def place(w):
+            return bx + (size - w) / 2
+    else:
+        _, right_x, ty = anchor
+
+        def place(w):
+            return right_x - w
+
+    price = []
+    for line, h in zip(lines, heights):
+        price.append((place(use_font.getlength(line)), ty, line))
+        ty += h + line_spacing
+
+    reg = strike = None
+    if has_reg:
+        w = font_reg.getlength(reg_text)
+        rx = place(w)
+        reg = (rx, ty)
+        strike = (rx, ty + reg_height / 2, rx + w, ty + reg_height / 2)
+
+    return {"font": use_font, "price": tuple(price), "reg": reg, "strike": strike}
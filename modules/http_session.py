@@ -0,0 +1,28 @@
+# modules/http_session.py
+#
+# One pooled requests.Session shared by every worker thread, so image
+# downloads and uploads reuse keep-alive connections (Amazon image CDN,
+# FreeImage) instead of opening a new one per row.
+
+import os
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+
+# Connections kept open per host; should be >= the widest pipeline stage
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "16"))
+
+_session = None
+_lock = threading.Lock()
+
+
+def get_session():
+    global _session
+    with _lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=8, pool_maxsize=HTTP_POOL_SIZE)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+        return _session
@@ -0,0 +1,94 @@
+# modules/job_journal.py
+#
+# Durable record of per-row progress inside process_sheet. If the
+# background job dies, the next run picks rows up where they stopped
+# instead of paying again for PA-API calls, renders, FreeImage uploads
+# and Gemini calls.
+#
+# Stages recorded per row:
+#   "autofill"   -> merged product data (title, image, prices, promos)
+#   "image_edit" -> {"url": uploaded EDITED_IMAGE link}
+#   "image_pin"  -> {"url": uploaded PINTREST_EDITED link}
+#   "caption"    -> {"text": caption}
+#   "comment"    -> {"text": comment}
+
+import json
+import time
+import logging
+
+from modules.local_store import LocalStore
+from modules import row_store
+
+logger = logging.getLogger(__name__)
+
+# Entries older than this are never resumed from
+MAX_AGE_SECONDS = 7 * 24 * 3600
+
+_store = LocalStore("job_journal.sqlite3", """
+CREATE TABLE IF NOT EXISTS row_journal (
+    sheet_key  TEXT NOT NULL,
+    row_num    INTEGER NOT NULL,
+    stage      TEXT NOT NULL,
+    input_fp   TEXT NOT NULL,
+    data       TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (sheet_key, row_num, stage)
+);
+""")
+
+
+def input_fingerprint(row):
+    """Hash of every input column; journal entries only apply while it matches."""
+    return row_store.fingerprint(row, row_store.IMAGE_INPUTS + row_store.TEXT_INPUTS)
+
+
+def load(key):
+    """{row_num: {"fp": ..., "stages": {stage: data}}} for the sheet."""
+    try:
+        _store.execute("DELETE FROM row_journal WHERE updated_at < ?", (time.time() - MAX_AGE_SECONDS,))
+        rows = _store.query(
+            "SELECT row_num, stage, input_fp, data FROM row_journal WHERE sheet_key = ?",
+            (key,),
+        )
+    except Exception as e:
+        logger.warning(f"Job journal unavailable: {e}")
+        return {}
+
+    entries = {}
+    for row_num, stage, fp, data in rows:
+        entry = entries.setdefault(row_num, {"fp": fp, "stages": {}})
+        if entry["fp"] == fp:
+            entry["stages"][stage] = json.loads(data)
+    if entries:
+        logger.info(f"Job journal: {len(entries)} row(s) with recorded progress")
+    return entries
+
+
+def resume_state(entries, row_num, fp):
+    """Recorded stages for a row, or {} if its inputs changed since."""
+    entry = entries.get(row_num)
+    if not entry or entry["fp"] != fp:
+        return {}
+    return dict(entry["stages"])
+
+
+def record(key, row_num, fp, stage, data):
+    try:
+        _store.execute(
+            "INSERT OR REPLACE INTO row_journal "
+            "(sheet_key, row_num, stage, input_fp, data, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (key, row_num, stage, fp, json.dumps(data, ensure_ascii=False), time.time()),
+        )
+    except Exception as e:
+        logger.warning(f"Failed to journal {stage} for row {row_num}: {e}")
+
+
+def clear(key, row_nums):
+    """Forget rows whose results are safely in the sheet."""
+    try:
+        _store.executemany(
+            "DELETE FROM row_journal WHERE sheet_key = ? AND row_num = ?",
+            [(key, n) for n in row_nums],
+        )
+    except Exception as e:
+        logger.warning(f"Failed to clear job journal: {e}")
@@ -0,0 +1,177 @@
+# modules/jobs.py
+#
+# In-process job manager for /run. Each sheet has at most one active job;
+# a /run that arrives while it is running is coalesced into it (one more
+# pass is queued) instead of starting a second, duplicate pass.
+
+import time
+import uuid
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Finished jobs kept around for GET /jobs/{id}
+MAX_FINISHED_JOBS = 50
+
+
+class Job:
+    """Status of one /run, updated by process_sheet as rows finish."""
+
+    def __init__(self, sheet_key):
+        self.id = uuid.uuid4().hex
+        self.sheet_key = sheet_key
+        self.status = "queued"
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+        self.passes = 0
+        self.rerun_requested = False
+
+        self.rows_total = 0
+        self.rows_skipped = 0
+        self.rows_pending = 0
+        self.rows_left_to_others = 0
+        self.rows_done = 0
+        self._pass_started = None
+        self._stats = None
+        self._lock = threading.Lock()
+
+    # ---------------------------
+    # PROGRESS HOOKS (process_sheet)
+    # ---------------------------
+    def begin(self, total, pending):
+        with self._lock:
+            self.rows_total = total
+            self.rows_skipped = total - pending
+            self.rows_pending = pending
+            self.rows_left_to_others = 0
+            self.rows_done = 0
+            self._pass_started = time.monotonic()
+            self._stats = None
+
+    def row_finished(self, idx):
+        with self._lock:
+            self.rows_done += 1
+
+    def rows_elsewhere(self, n):
+        """
+        `n` pending rows were leased by another worker. They are not done:
+        a pass that leaves rows to others ends "incomplete".
+        """
+        with self._lock:
+            self.rows_pending -= n
+            self.rows_left_to_others += n
+
+    def track(self, stats):
+        """`stats()` returns live per-stage numbers (StagedPipeline.stats)."""
+        self._stats = stats
+
+    # ---------------------------
+    # REPORTING
+    # ---------------------------
+    def to_dict(self):
+        with self._lock:
+            remaining = max(0, self.rows_pending - self.rows_done)
+            eta = None
+            if self.status == "running" and self.rows_done and self._pass_started:
+                elapsed = time.monotonic() - self._pass_started
+                eta = round(remaining * elapsed / self.rows_done, 1)
+
+            return {
+                "job_id": self.id,
+                "status": self.status,
+                "error": self.error,
+                "created_at": self.created_at,
+                "started_at": self.started_at,
+                "finished_at": self.finished_at,
+                "passes": self.passes,
+                "rerun_queued": self.rerun_requested,
+                "rows_total": self.rows_total,
+                "rows_skipped": self.rows_skipped,
+                "rows_done": self.rows_done,
+                "rows_pending": remaining,
+                "rows_elsewhere": self.rows_left_to_others,
+                "eta_seconds": eta,
+                "stages": self._stats() if self._stats else {},
+            }
+
+
+class JobManager:
+
+    def __init__(self):
+        self._jobs = OrderedDict()
+        self._active = {}  # sheet_key -> Job
+        self._lock = threading.Lock()
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def coalesce(self, sheet_key):
+        """
+        Coalesce into the sheet's running job, if there is one.
+        Returns that job, or None when the sheet is idle.
+        """
+        with self._lock:
+            active = self._active.get(sheet_key)
+            if active is not None:
+                active.rerun_requested = True
+            return active
+
+    def submit(self, sheet_key, target):
+        """
+        Run `target(job)` in the background for `sheet_key`.
+        Returns (job, started); started is False when the request was
+        coalesced into the job already running for that sheet.
+        """
+        with self._lock:
+            active = self._active.get(sheet_key)
+            if active is not None:
+                active.rerun_requested = True
+                return active, False
+
+            job = Job(sheet_key)
+            self._jobs[job.id] = job
+            self._active[sheet_key] = job
+            self._prune()
+
+        threading.Thread(
+            target=self._run,
+            args=(job, target),
+            name=f"job-{job.id[:8]}",
+            daemon=True,
+        ).start()
+        return job, True
+
+    def _run(self, job, target):
+        job.status = "running"
+        job.started_at = time.time()
+        try:
+            while True:
+                job.passes += 1
+                target(job)
+                with self._lock:
+                    if not job.rerun_requested:
+                        # no more /run calls to honour; release the sheet
+                        del self._active[job.sheet_key]
+                        break
+                    job.rerun_requested = False
+                logger.info(f"Job {job.id}: starting coalesced pass {job.passes + 1}")
+            job.status = "incomplete" if job.rows_left_to_others else "finished"
+        except Exception as e:
+            logger.exception(f"Job {job.id} failed")
+            job.status = "failed"
+            job.error = str(e)
+            with self._lock:
+                self._active.pop(job.sheet_key, None)
+        finally:
+            job.finished_at = time.time()
+
+    def _prune(self):
+        finished = [j for j in self._jobs.values() if j.status in ("finished", "incomplete", "failed")]
+        for job in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self._jobs[job.id]
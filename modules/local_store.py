@@ -0,0 +1,53 @@
+# modules/local_store.py
+#
+# Tiny SQLite helper for the app's local state (row fingerprints, caches,
+# journals). Files live in STATE_DIR, next to the app by default.
+
+import os
+import sqlite3
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STATE_DIR = os.getenv("STATE_DIR", os.path.join(BASE_DIR, "data"))
+
+
+class LocalStore:
+    """
+    One SQLite database file, shared by all threads of the process.
+    `schema` is run once when the file is first opened.
+    """
+
+    def __init__(self, filename, schema):
+        self.path = os.path.join(STATE_DIR, filename)
+        self.schema = schema
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(self.schema)
+            self._conn = conn
+        return self._conn
+
+    def query(self, sql, params=()):
+        with self._lock:
+            return self._connect().execute(sql, params).fetchall()
+
+    def execute(self, sql, params=()):
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                return conn.execute(sql, params).rowcount
+
+    def executemany(self, sql, seq):
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.executemany(sql, seq)
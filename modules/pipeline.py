@@ -0,0 +1,178 @@
+# modules/pipeline.py
+#
+# Small staged producer/consumer pipeline used by process_sheet.
+# Each stage owns a bounded input queue and a pool of worker threads;
+# a full queue blocks the stage in front of it (backpressure).
+
+import time
+import queue
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class Stage:
+    """
+    One pipeline step.
+    `func(item)` mutates the item dict in place. If it raises, the error is
+    stored in item["error"], the remaining stages are skipped and the item
+    goes straight to the pipeline output.
+    """
+
+    def __init__(self, name, func, workers=1, queue_size=16):
+        self.name = name
+        self.func = func
+        self.workers = max(1, int(workers))
+        self.queue = queue.Queue(maxsize=max(1, int(queue_size)))
+
+        self._lock = threading.Lock()
+        self._alive = 0
+        self.processed = 0
+        self.failed = 0
+        self.busy_seconds = 0.0
+        self.max_depth = 0
+        self.started_at = None
+        self.finished_at = None
+
+    def _note_depth(self):
+        depth = self.queue.qsize()
+        if depth > self.max_depth:
+            self.max_depth = depth
+
+    def _record(self, elapsed, failed):
+        with self._lock:
+            self.processed += 1
+            self.busy_seconds += elapsed
+            if failed:
+                self.failed += 1
+
+    def process(self, item):
+        """Run `func` on one item and record its timing; False if it raised."""
+        t0 = time.monotonic()
+        failed = False
+        try:
+            self.func(item)
+        except Exception as e:
+            logger.error(f"Stage {self.name} failed: {e}")
+            item["error"] = e
+            failed = True
+        self._record(time.monotonic() - t0, failed)
+        return not failed
+
+    def stats(self):
+        with self._lock:
+            now = self.finished_at or time.monotonic()
+            wall = (now - self.started_at) if self.started_at else 0.0
+            depth = self.queue.qsize()
+            self._note_depth()
+            return {
+                "workers": self.workers,
+                "queue_depth": depth,
+                "max_queue_depth": self.max_depth,
+                "processed": self.processed,
+                "failed": self.failed,
+                "busy_seconds": round(self.busy_seconds, 3),
+                "avg_seconds": round(self.busy_seconds / self.processed, 3) if self.processed else 0.0,
+                "throughput_per_s": round(self.processed / wall, 3) if wall > 0 else 0.0,
+                # share of the pool's capacity spent working; ~1.0 = bottleneck
+                "utilization": round(self.busy_seconds / (wall * self.workers), 3) if wall > 0 else 0.0,
+            }
+
+
+class StagedPipeline:
+    """
+    Run items (dicts) through `stages` in order.
+    `on_done(item)` is called once per item, from a worker thread,
+    when the item leaves the pipeline.
+    """
+
+    def __init__(self, stages, on_done=None):
+        self.stages = list(stages)
+        self.on_done = on_done
+        self._done_lock = threading.Lock()
+
+    def _finish(self, item):
+        if self.on_done:
+            try:
+                with self._done_lock:
+                    self.on_done(item)
+            except Exception:
+                logger.exception("Pipeline on_done callback failed")
+
+    def _worker(self, pos):
+        stage = self.stages[pos]
+        nxt = self.stages[pos + 1] if pos + 1 < len(self.stages) else None
+
+        while True:
+            item = stage.queue.get()
+            if item is _STOP:
+                break
+
+            stage.process(item)
+            if nxt is None or item.get("error"):
+                self._finish(item)
+            else:
+                nxt.queue.put(item)
+                nxt._note_depth()
+
+        # Last worker out tells the next stage to stop
+        with stage._lock:
+            stage._alive -= 1
+            last = stage._alive == 0
+            if last:
+                stage.finished_at = time.monotonic()
+        if last and nxt is not None:
+            for _ in range(nxt.workers):
+                nxt.queue.put(_STOP)
+
+    def run(self, items):
+        """Feed `items` through the pipeline and block until all are done."""
+        threads = []
+        now = time.monotonic()
+        for pos, stage in enumerate(self.stages):
+            stage._alive = stage.workers
+            stage.started_at = now
+            for n in range(stage.workers):
+                t = threading.Thread(
+                    target=self._worker,
+                    args=(pos,),
+                    name=f"{stage.name}-{n}",
+                    daemon=True,
+                )
+                t.start()
+                threads.append(t)
+
+        first = self.stages[0]
+        for item in items:
+            first.queue.put(item)
+            first._note_depth()
+        for _ in range(first.workers):
+            first.queue.put(_STOP)
+
+        for t in threads:
+            t.join()
+
+    def run_inline(self, items):
+        """
+        Like run(), but without worker threads: each item goes through
+        every stage on the calling thread before the next one starts.
+        Stage stats are recorded the same way.
+        """
+        now = time.monotonic()
+        for stage in self.stages:
+            stage.started_at = now
+        for item in items:
+            for stage in self.stages:
+                if not stage.process(item):
+                    break
+            self._finish(item)
+        now = time.monotonic()
+        for stage in self.stages:
+            stage.finished_at = now
+
+    def stats(self):
+        """Per-stage queue depth, throughput and utilization snapshot."""
+        return {stage.name: stage.stats() for stage in self.stages}
@@ -1,10 +1,11 @@
 # modules/processor.py  (FINAL VERSION WITH MANUAL PROMO SUPPORT)
 
 import os
+import time
 import socket
 import ipaddress
 import logging
-import requests
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urlparse
 from datetime import datetime
 import gspread
@@ -12,16 +13,38 @@ import gspread
 # ----------------------------------------
 # UPDATED IMPORTS FOR NEW FOLDER STRUCTURE
 # ----------------------------------------
-from image_engine.image_composer import compose_image
+from image_engine import render_pool
+from image_engine.encoder import output_format
 from caption_engine.caption_generator import generate_affiliate_caption
 from caption_engine.comment_generator import generate_comment_prompt
 
 # Autofill (PA-API + Promo Code Scraper)
 from autofill.autofill_engine import get_product_data
+from autofill.asin_extractor import extract_asin
+from autofill.paapi_autofill import fetch_product_data_many
+from autofill import product_cache
+
+from modules.pipeline import Stage, StagedPipeline
+from modules import row_store, job_journal
+from modules.sheet_writer import SheetWriter, WriteBehind, changed_cells
+from modules.row_leases import RowClaimer
+from modules.http_session import get_session
 
 logger = logging.getLogger(__name__)
 
 MAX_DOWNLOAD_BYTES = 5_000_000
+DOWNLOAD_CHUNK_BYTES = 64 * 1024
+
+# "memory": download, render and upload images without touching disk
+# "disk": legacy path through images/ temp files
+IMAGE_IO_MODE = os.getenv("IMAGE_IO_MODE", "memory").lower()
+
+# Width of the network-bound pipeline stages (1 = sequential, no threads)
+PROCESS_WORKERS = int(os.getenv("PROCESS_WORKERS", "4"))
+# Per-stage overrides, e.g. "autofill=8,render=2,upload=6"
+STAGE_WORKERS = os.getenv("STAGE_WORKERS", "")
+# Bounded queue in front of each stage (backpressure)
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "16"))
 
 COLOR_MAP = {
     "red": "#FF0000",
@@ -96,17 +119,38 @@ def make_local_filename(url):
     return name
 
 
+def fetch_image(url):
+    """
+    Stream an image into memory over the shared pooled session and
+    return its bytes. Gives up as soon as the response is not an image
+    or is (or grows) larger than MAX_DOWNLOAD_BYTES.
+    """
+    with get_session().get(url, headers={"User-Agent": "Mozilla"}, timeout=30, stream=True) as resp:
+        resp.raise_for_status()
+
+        content_type = resp.headers.get("Content-Type", "").split(";")[0].strip().lower()
+        if content_type and not content_type.startswith("image/"):
+            raise ValueError(f"Not an image (Content-Type {content_type})")
+
+        length = resp.headers.get("Content-Length", "")
+        if length.isdigit() and int(length) > MAX_DOWNLOAD_BYTES:
+            raise ValueError("Image too large")
+
+        content = bytearray()
+        for chunk in resp.iter_content(chunk_size=DOWNLOAD_CHUNK_BYTES):
+            content += chunk
+            if len(content) > MAX_DOWNLOAD_BYTES:
+                raise ValueError("Image too large")
+
+    return bytes(content)
+
+
 def download_image(url, idx):
+    """fetch_image() saved to images/{idx}_{name}; returns the path."""
     fn = make_local_filename(url)
     local_path = os.path.join("images", f"{idx}_{fn}")
 
-    resp = requests.get(url, headers={"User-Agent": "Mozilla"}, timeout=30)
-    resp.raise_for_status()
-
-    content = resp.content
-    if len(content) > MAX_DOWNLOAD_BYTES:
-        raise ValueError("Image too large")
-
+    content = fetch_image(url)
     with open(local_path, "wb") as f:
         f.write(content)
 
@@ -116,270 +160,682 @@ def download_image(url, idx):
 # ---------------------------
 # UPLOAD TO FREEIMAGE
 # ---------------------------
-def upload_to_freeimage(path, api_key):
+def upload_to_freeimage(image, api_key):
+    """Upload a file path or in-memory render bytes; returns the image URL."""
     endpoint = f"https://freeimage.host/api/1/upload?key={api_key}"
 
-    with open(path, "rb") as f:
-        resp = requests.post(endpoint, files={"source": f})
+    if isinstance(image, (bytes, bytearray)):
+        fmt = output_format()
+        resp = get_session().post(endpoint, files={"source": (f"image.{fmt['ext']}", image, fmt["mime"])})
+    else:
+        with open(image, "rb") as f:
+            resp = get_session().post(endpoint, files={"source": f})
 
     resp.raise_for_status()
     return resp.json()["image"]["url"]
 
 
+def save_local_render(data, idx, variant):
+    """Without a FreeImage key, keep the render on disk and link to it."""
+    os.makedirs("images", exist_ok=True)
+    path = os.path.join("images", f"{idx}_{variant}_final.{output_format()['ext']}")
+    with open(path, "wb") as f:
+        f.write(data)
+    return os.path.abspath(path)
+
+
 # ---------------------------
-# MAIN GOOGLE SHEET PROCESSOR
+# SHEET COLUMNS
 # ---------------------------
-def process_sheet(sheet, freeimage_key):
+OUTPUT_COLUMNS = [
+    "EDITED_IMAGE",
+    "PINTREST_EDITED",
+    "CAPTION_WITH_HASHTAG",
+    "COMMENTS",
+]
+
+AUTOFILL_COLUMNS = [
+    "PRODUCT_TITLE",
+    "IMAGEURL",
+    "PRICE",
+    "REG",
+]
+
+
+def _row_result(link1, link2, caption, comment, product_name, image_url, price, reg):
+    return {
+        "EDITED_IMAGE": link1,
+        "PINTREST_EDITED": link2,
+        "CAPTION_WITH_HASHTAG": caption,
+        "COMMENTS": comment,
+        "PRODUCT_TITLE": product_name,
+        "IMAGEURL": image_url,
+        "PRICE": price,
+        "REG": reg,
+    }
 
-    logger.info("START processing…")
 
-    records = sheet.get_all_records()
-    headers = sheet.row_values(1)
-
-    def ensure(col):
-        if col in headers:
-            return headers.index(col) + 1
-        pos = len(headers) + 1
-        sheet.update_cell(1, pos, col)
-        headers.append(col)
-        return pos
-
-    # Ensure output columns
-    col_edit = ensure("EDITED_IMAGE")
-    col_pin = ensure("PINTREST_EDITED")
-    col_caption = ensure("CAPTION_WITH_HASHTAG")
-    col_comment = ensure("COMMENTS")
-
-    # Ensure autofill input columns
-    col_product_title = ensure("PRODUCT_TITLE")
-    col_imageurl = ensure("IMAGEURL")
-    col_price = ensure("PRICE")
-    col_reg = ensure("REG")
-
-    edited_results = []
-    pinterest_results = []
-    caption_results = []
-    comment_results = []
-
-    product_title_results = []
-    imageurl_results = []
-    price_results = []
-    reg_results = []
+# ---------------------------
+# ROW STAGES
+# ---------------------------
+# Each stage takes the row context dict built by new_row_context() and
+# fills in more of it. Stages may raise; the row then ends up as "ERROR".
 
-    # ----------------------------------------
-    # PROCESS ROWS
-    # ----------------------------------------
-    for idx, row in enumerate(records, start=2):
+def classify_row(row, stale=()):
+    """
+    Cheap, offline pre-pass check on the four output columns:
+    "complete" (all filled), "partial" (some filled) or "new" (none).
+    Rows whose outputs are out of date (see row_store.stale_outputs)
+    are "changed".
+    """
+    if stale:
+        return "changed"
+    filled = sum(1 for name in OUTPUT_COLUMNS if row.get(name))
+    if filled == len(OUTPUT_COLUMNS):
+        return "complete"
+    if filled:
+        return "partial"
+    return "new"
+
+
+def existing_result(row):
+    """Write-back values for a row that needs no work: what is already there."""
+    return _row_result(
+        row.get("EDITED_IMAGE") or "",
+        row.get("PINTREST_EDITED") or "",
+        row.get("CAPTION_WITH_HASHTAG") or "",
+        row.get("COMMENTS") or "",
+        row.get("PRODUCT_TITLE") or "",
+        row.get("IMAGEURL") or "",
+        row.get("PRICE") or "",
+        row.get("REG") or "",
+    )
+
+
+def new_row_context(idx, row, stale=(), journal=None):
+    """
+    Row context for the stages. `journal` is {"key", "fp", "stages"}
+    (see job_journal); work already recorded there is not redone.
+    """
+    ctx = {
+        "idx": idx,
+        "row": row,
+        "existing_edited": row.get("EDITED_IMAGE") or "",
+        "existing_pin": row.get("PINTREST_EDITED") or "",
+        "existing_caption": row.get("CAPTION_WITH_HASHTAG") or "",
+        "existing_comment": row.get("COMMENTS") or "",
+        "product_name": "",
+        "image_url": "",
+        "price": "",
+        "reg": "",
+        "local": None,
+        "out1": None,
+        "out2": None,
+        # outputs rebuilt from this run's inputs (see refreshed_groups)
+        "regenerated": set(),
+    }
+    ctx["need_edit"] = not bool(ctx["existing_edited"]) or "images" in stale
+    ctx["need_pin"] = not bool(ctx["existing_pin"]) or "images" in stale
+    ctx["need_caption"] = not bool(ctx["existing_caption"]) or "text" in stale
+    ctx["need_comment"] = not bool(ctx["existing_comment"]) or "text" in stale
+
+    ctx["journal"] = journal
+    done = journal["stages"] if journal else {}
+
+    # Outputs produced by an interrupted run count as existing
+    for stage, existing, need in [
+        ("image_edit", "existing_edited", "need_edit"),
+        ("image_pin", "existing_pin", "need_pin"),
+    ]:
+        if ctx[need] and stage in done:
+            ctx[existing] = done[stage]["url"]
+            ctx[need] = False
+
+    for stage, existing, need in [
+        ("caption", "existing_caption", "need_caption"),
+        ("comment", "existing_comment", "need_comment"),
+    ]:
+        if ctx[need] and stage in done:
+            ctx[existing] = done[stage]["text"]
+            ctx[need] = False
+
+    return ctx
+
+
+def needs_autofill(ctx):
+    """
+    Whether stage_autofill will look the product up. Only images and
+    captions use autofilled data; a row that just needs a comment and
+    already has a title skips the network, as does a row whose autofill
+    was journaled by an interrupted run.
+    """
+    row = ctx["row"]
+    journal = ctx.get("journal")
+    if journal and journal["stages"].get("autofill"):
+        return False
+    if not (row.get("DEAL_URL") or ""):
+        return False
+    return (
+        ctx["need_edit"] or ctx["need_pin"] or ctx["need_caption"]
+        or not (row.get("PRODUCT_TITLE") or "")
+    )
+
+
+def prefetch_products(ctxs, workers=1):
+    """
+    Look up the PA-API data of every row in `ctxs` that is going to
+    autofill with batched GetItems calls (deduped, 10 ASINs per call)
+    instead of one call per row. ASINs (short links need redirects) are
+    resolved `workers` at a time. Stores {"asin", "pa", "cached"} in
+    ctx["prefetched"] for stage_autofill.
+    """
+    todo = [ctx for ctx in ctxs if needs_autofill(ctx)]
+    if not todo:
+        return
 
-        existing_edited = row.get("EDITED_IMAGE") or ""
-        existing_pin = row.get("PINTREST_EDITED") or ""
-        existing_caption = row.get("CAPTION_WITH_HASHTAG") or ""
-        existing_comment = row.get("COMMENTS") or ""
+    def lookup_asin(ctx):
+        try:
+            return extract_asin(ctx["row"].get("DEAL_URL"))
+        except Exception as e:
+            logger.warning(f"ASIN lookup failed for row {ctx['idx']}: {e}")
+            return None
+
+    if workers > 1 and len(todo) > 1:
+        with ThreadPoolExecutor(max_workers=min(workers, len(todo)), thread_name_prefix="asin") as pool:
+            asins = list(pool.map(lookup_asin, todo))
+    else:
+        asins = [lookup_asin(ctx) for ctx in todo]
+    wanted = {ctx["idx"]: asin for ctx, asin in zip(todo, asins) if asin is not None}
+    if not wanted:
+        return
+
+    # Products fully served by the product cache need no PA-API call
+    cached = {asin: product_cache.lookup(asin) for asin in set(wanted.values()) if asin}
+    to_fetch = [asin for asin, fresh in cached.items() if product_cache.stale_groups(fresh)]
 
-        local = None
-        out1 = None
-        out2 = None
+    try:
+        products = fetch_product_data_many(to_fetch)
+    except Exception:
+        logger.exception("Batched PA-API lookup failed")
+        return
+
+    seen = set()
+    for ctx in ctxs:
+        if ctx["idx"] in wanted:
+            asin = wanted[ctx["idx"]]
+            ctx["prefetched"] = {"asin": asin}
+            if asin in products:
+                ctx["prefetched"]["pa"] = products[asin]
+            # Later rows with the same ASIN look the cache up again and
+            # find what the first one stored
+            if asin in cached and asin not in seen:
+                ctx["prefetched"]["cached"] = cached[asin]
+                seen.add(asin)
+
+
+def _journal(ctx, stage, data):
+    journal = ctx.get("journal")
+    if journal:
+        job_journal.record(journal["key"], ctx["idx"], journal["fp"], stage, data)
+
+
+def stage_autofill(ctx):
+    row = ctx["row"]
 
+    # ---------------------------
+    # READ INPUTS
+    # ---------------------------
+    link = row.get("DEAL_URL") or ""
+    product_name = row.get("PRODUCT_TITLE") or ""
+    image_url = row.get("IMAGEURL") or ""
+    price = row.get("PRICE") or ""
+    reg = row.get("REG") or ""
+    ctx.update(link=link, product_name=product_name, image_url=image_url, price=price, reg=reg)
+
+    ctx["badge"] = row.get("BADGE") or "circle"
+    raw_color = row.get("COLOR") or row.get("BADGE_COLOR")
+    ctx["color"] = clean_color(raw_color)
+
+    # -------------------------------------------
+    # NEW: MANUAL PROMO CODE FROM SHEET
+    # -------------------------------------------
+    manual_promo_code = row.get("PROMO_CODE", "").strip()
+    ctx["manual_promo_code"] = manual_promo_code
+
+    promo_data = None
+    promo_code_data = None
+
+    # ---------------------------
+    # AUTOFILL (PA-API + SCRAPER)
+    # ---------------------------
+    need_images = ctx["need_edit"] or ctx["need_pin"]
+
+    journal = ctx.get("journal")
+    resumed = journal["stages"].get("autofill") if journal else None
+
+    if resumed:
+        # Autofill already ran for these inputs in an interrupted run
+        product_name = resumed["product_name"]
+        image_url = resumed["image_url"]
+        price = resumed["price"]
+        reg = resumed["reg"]
+        promo_data = resumed["promo_data"]
+        promo_code_data = resumed["promo_code_data"]
+
+    elif needs_autofill(ctx):
         try:
-            # ---------------------------
-            # READ INPUTS
-            # ---------------------------
-            link = row.get("DEAL_URL") or ""
-            product_name = row.get("PRODUCT_TITLE") or ""
-            image_url = row.get("IMAGEURL") or ""
-            price = row.get("PRICE") or ""
-            reg = row.get("REG") or ""
-            badge = row.get("BADGE") or "circle"
-            raw_color = row.get("COLOR") or row.get("BADGE_COLOR")
-            color = clean_color(raw_color)
+            # PA-API data may already be batch-fetched (prefetch_products)
+            autofill = get_product_data(link, **(ctx.get("prefetched") or {}))
+        except Exception:
+            logger.exception("Autofill failed")
+            autofill = None
+
+        if autofill:
+            if not product_name:
+                product_name = autofill.get("title", product_name)
+
+            if not image_url:
+                image_url = autofill.get("image", image_url)
+
+            if not price:
+                price = autofill.get("price", price)
+
+            if not reg:
+                reg = autofill.get("reg_price", reg)
+
+            promo_data = autofill.get("promo")
+            promo_code_data = autofill.get("promo_code")
 
             # -------------------------------------------
-            # NEW: MANUAL PROMO CODE FROM SHEET
+            # MANUAL PROMO OVERRIDE (ONLY WHEN PROVIDED)
             # -------------------------------------------
-            manual_promo_code = row.get("PROMO_CODE", "").strip()
-
-            promo_data = None
-            promo_code_data = None
-
-            # ---------------------------
-            # AUTOFILL (PA-API + SCRAPER)
-            # ---------------------------
-            if link:
-                try:
-                    autofill = get_product_data(link)
-                except Exception:
-                    logger.exception("Autofill failed")
-                    autofill = None
-
-                if autofill:
-                    if not product_name:
-                        product_name = autofill.get("title", product_name)
-
-                    if not image_url:
-                        image_url = autofill.get("image", image_url)
-
-                    if not price:
-                        price = autofill.get("price", price)
-
-                    if not reg:
-                        reg = autofill.get("reg_price", reg)
-
-                    promo_data = autofill.get("promo")
-                    promo_code_data = autofill.get("promo_code")
-
-                    # -------------------------------------------
-                    # MANUAL PROMO OVERRIDE (ONLY WHEN PROVIDED)
-                    # -------------------------------------------
-                    if manual_promo_code:
-                        promo_code_data = {
-                            "has_promo": True,
-                            "code": manual_promo_code,
-                            "discount": "",
-                            "text": f"Use code {manual_promo_code}"
-                        }
-
-            # Safety
-            image_url = validate_image_url(image_url)
-
-            need_edit = not bool(existing_edited)
-            need_pin = not bool(existing_pin)
-            need_caption = not bool(existing_caption)
-            need_comment = not bool(existing_comment)
-
-            if not (need_edit or need_pin or need_caption or need_comment):
-                edited_results.append([existing_edited])
-                pinterest_results.append([existing_pin])
-                caption_results.append([existing_caption])
-                comment_results.append([existing_comment])
-
-                product_title_results.append([product_name])
-                imageurl_results.append([image_url])
-                price_results.append([price])
-                reg_results.append([reg])
-                continue
-
-            # ---------------------------
-            # DOWNLOAD IMAGE
-            # ---------------------------
-            if (need_edit or need_pin) and image_url:
-                try:
-                    os.makedirs("images", exist_ok=True)
-                    local = download_image(image_url, idx)
-                except Exception as e:
-                    logger.warning(f"Failed to download image for row {idx}: {e}")
-                    local = None
-
-            link1 = existing_edited
-            link2 = existing_pin
-
-            # ---------------------------
-            # COMPOSE IMAGES
-            # ---------------------------
-            if need_edit and local:
-                out1 = compose_image(
-                    local,
-                    price_text=price,
-                    badge_type=badge,
-                    badge_color=color,
-                    include_link=True,
-                    reg_text=reg,
-                )
-                try:
-                    if freeimage_key:
-                        link1 = upload_to_freeimage(out1, freeimage_key)
-                    else:
-                        link1 = out1
-                except:
-                    link1 = out1 or existing_edited
-
-            if need_pin and local:
-                out2 = compose_image(
-                    local,
-                    price_text=price,
-                    badge_type=badge,
-                    badge_color=color,
-                    include_link=False,
-                    reg_text=reg,
-                )
-                try:
-                    if freeimage_key:
-                        link2 = upload_to_freeimage(out2, freeimage_key)
-                    else:
-                        link2 = out2
-                except:
-                    link2 = out2 or existing_pin
-
-            # ---------------------------
-            # CAPTION & COMMENT
-            # ---------------------------
-            caption = existing_caption
-            comment_text = existing_comment
-
-            if need_caption:
-                try:
-                    caption = generate_affiliate_caption(
-                        product_name,
-                        link,
-                        promo_data,
-                        promo_code_data  # <- promo (auto OR manual)
-                    )
-                except:
-                    head = "(Ad)(#CommissionEarned)"
-                    header_text = f"{head}\n{product_name}" if product_name else head
-                    caption = f"{header_text}\n\n👉 {link}"
-
-            if need_comment:
-                comment_text = generate_comment_prompt(product_name)
-
-                # OPTIONAL: include manual promo code in comments
-                if manual_promo_code:
-                    comment_text += f"\n✨ Use Code: {manual_promo_code} (may expire anytime)"
-
-            # ---------------------------
-            # STORE OUTPUTS
-            # ---------------------------
-            edited_results.append([link1])
-            pinterest_results.append([link2])
-            caption_results.append([caption])
-            comment_results.append([comment_text])
-
-            product_title_results.append([product_name])
-            imageurl_results.append([image_url])
-            price_results.append([price])
-            reg_results.append([reg])
-
+            if manual_promo_code:
+                promo_code_data = {
+                    "has_promo": True,
+                    "code": manual_promo_code,
+                    "discount": "",
+                    "text": f"Use code {manual_promo_code}"
+                }
+
+            _journal(ctx, "autofill", {
+                "product_name": product_name,
+                "image_url": image_url,
+                "price": price,
+                "reg": reg,
+                "promo_data": promo_data,
+                "promo_code_data": promo_code_data,
+            })
+
+    ctx.update(product_name=product_name, image_url=image_url, price=price, reg=reg)
+    ctx["promo_data"] = promo_data
+    ctx["promo_code_data"] = promo_code_data
+
+    # Safety (only matters when the image is about to be downloaded)
+    if need_images:
+        image_url = validate_image_url(image_url)
+    ctx["image_url"] = image_url
+
+
+def stage_fetch(ctx):
+    # ---------------------------
+    # DOWNLOAD IMAGE
+    # ---------------------------
+    if (ctx["need_edit"] or ctx["need_pin"]) and ctx["image_url"]:
+        try:
+            if IMAGE_IO_MODE == "disk":
+                os.makedirs("images", exist_ok=True)
+                ctx["local"] = download_image(ctx["image_url"], ctx["idx"])
+            else:
+                ctx["local"] = fetch_image(ctx["image_url"])
         except Exception as e:
-            logger.error(f"Row {idx} failed: {e}")
-
-            edited_results.append(["ERROR"])
-            pinterest_results.append(["ERROR"])
-            caption_results.append(["ERROR"])
-            comment_results.append(["ERROR"])
-
-            product_title_results.append([product_name])
-            imageurl_results.append([image_url])
-            price_results.append([price])
-            reg_results.append([reg])
-
-        # Cleanup
-        for p in [local, out1, out2]:
-            if p and os.path.exists(p):
-                try:
-                    os.remove(p)
-                except:
-                    pass
+            logger.warning(f"Failed to download image for row {ctx['idx']}: {e}")
+            ctx["local"] = None
+
 
+def stage_render(ctx):
     # ---------------------------
-    # WRITE BACK TO SHEET
+    # COMPOSE IMAGES
+    # ---------------------------
+    # Both variants come from one decode of the source image
+    local = ctx["local"]
+    if not local:
+        return
+
+    variants = []
+    if ctx["need_edit"]:
+        variants.append("edited")
+    if ctx["need_pin"]:
+        variants.append("pinterest")
+    if not variants:
+        return
+
+    rendered = render_pool.render(
+        local,
+        price_text=ctx["price"],
+        badge_type=ctx["badge"],
+        badge_color=ctx["color"],
+        reg_text=ctx["reg"],
+        variants=variants,
+    )
+
+    if isinstance(local, str):
+        # disk mode: hand the uploader files next to the download
+        base, _ = os.path.splitext(local)
+        for name, data in rendered.items():
+            path = f"{base}_{name}_final.{output_format()['ext']}"
+            with open(path, "wb") as f:
+                f.write(data)
+            rendered[name] = path
+
+    ctx["out1"] = rendered.get("edited")
+    ctx["out2"] = rendered.get("pinterest")
+
+
+def stage_upload(ctx, freeimage_key):
+    link1 = ctx["existing_edited"]
+    link2 = ctx["existing_pin"]
+    out1 = ctx["out1"]
+    out2 = ctx["out2"]
+
+    if out1:
+        try:
+            if freeimage_key:
+                link1 = upload_to_freeimage(out1, freeimage_key)
+                _journal(ctx, "image_edit", {"url": link1})
+            elif isinstance(out1, bytes):
+                link1 = save_local_render(out1, ctx["idx"], "edited")
+            else:
+                link1 = out1
+            ctx["regenerated"].add("edited")
+        except:
+            link1 = (out1 if isinstance(out1, str) else None) or ctx["existing_edited"]
+
+    if out2:
+        try:
+            if freeimage_key:
+                link2 = upload_to_freeimage(out2, freeimage_key)
+                _journal(ctx, "image_pin", {"url": link2})
+            elif isinstance(out2, bytes):
+                link2 = save_local_render(out2, ctx["idx"], "pinterest")
+            else:
+                link2 = out2
+            ctx["regenerated"].add("pinterest")
+        except:
+            link2 = (out2 if isinstance(out2, str) else None) or ctx["existing_pin"]
+
+    ctx["link1"] = link1
+    ctx["link2"] = link2
+
+
+def stage_text(ctx):
     # ---------------------------
-    sheet.update(f"{chr(64 + col_edit)}2:{chr(64 + col_edit)}{len(records) + 1}", edited_results)
-    sheet.update(f"{chr(64 + col_pin)}2:{chr(64 + col_pin)}{len(records) + 1}", pinterest_results)
-    sheet.update(f"{chr(64 + col_caption)}2:{chr(64 + col_caption)}{len(records) + 1}", caption_results)
-    sheet.update(f"{chr(64 + col_comment)}2:{chr(64 + col_comment)}{len(records) + 1}", comment_results)
-
-    sheet.update(f"{chr(64 + col_product_title)}2:{chr(64 + col_product_title)}{len(records) + 1}", product_title_results)
-    sheet.update(f"{chr(64 + col_imageurl)}2:{chr(64 + col_imageurl)}{len(records) + 1}", imageurl_results)
-    sheet.update(f"{chr(64 + col_price)}2:{chr(64 + col_price)}{len(records) + 1}", price_results)
-    sheet.update(f"{chr(64 + col_reg)}2:{chr(64 + col_reg)}{len(records) + 1}", reg_results)
+    # CAPTION & COMMENT
+    # ---------------------------
+    product_name = ctx["product_name"]
+    link = ctx["link"]
+    manual_promo_code = ctx["manual_promo_code"]
+
+    caption = ctx["existing_caption"]
+    comment_text = ctx["existing_comment"]
+
+    if ctx["need_caption"]:
+        try:
+            caption = generate_affiliate_caption(
+                product_name,
+                link,
+                ctx["promo_data"],
+                ctx["promo_code_data"]  # <- promo (auto OR manual)
+            )
+            _journal(ctx, "caption", {"text": caption})
+        except:
+            # the fallback caption is still built from the current inputs
+            head = "(Ad)(#CommissionEarned)"
+            header_text = f"{head}\n{product_name}" if product_name else head
+            caption = f"{header_text}\n\n👉 {link}"
+
+    if ctx["need_comment"]:
+        comment_text = generate_comment_prompt(product_name)
+
+        # OPTIONAL: include manual promo code in comments
+        if manual_promo_code:
+            comment_text += f"\n✨ Use Code: {manual_promo_code} (may expire anytime)"
+
+        _journal(ctx, "comment", {"text": comment_text})
+
+    if ctx["need_caption"]:
+        ctx["regenerated"].add("caption")
+    if ctx["need_comment"]:
+        ctx["regenerated"].add("comment")
+    ctx["caption"] = caption
+    ctx["comment"] = comment_text
+
+
+def finish_row(ctx):
+    """Clean up temp files and return the row's write-back values."""
+    for p in [ctx["local"], ctx["out1"], ctx["out2"]]:
+        if isinstance(p, str) and os.path.exists(p):
+            try:
+                os.remove(p)
+            except:
+                pass
+
+    if ctx.get("error") is not None:
+        logger.error(f"Row {ctx['idx']} failed: {ctx['error']}")
+        return _row_result(
+            "ERROR", "ERROR", "ERROR", "ERROR",
+            ctx["product_name"], ctx["image_url"], ctx["price"], ctx["reg"],
+        )
+
+    return _row_result(
+        ctx["link1"], ctx["link2"], ctx["caption"], ctx["comment"],
+        ctx["product_name"], ctx["image_url"], ctx["price"], ctx["reg"],
+    )
+
+
+def refreshed_groups(ctx):
+    """
+    Output groups ("images", "text") of a finished row context whose
+    values now match the row's inputs: every output the row needed was
+    rebuilt. A failed download or upload keeps the old image link, so
+    "images" is then left out and the group stays stale for the next run.
+    """
+    if ctx.get("error") is not None:
+        return set()
+    made = ctx["regenerated"]
+    groups = set()
+    if ((not ctx["need_edit"] or "edited" in made)
+            and (not ctx["need_pin"] or "pinterest" in made)):
+        groups.add("images")
+    if ((not ctx["need_caption"] or "caption" in made)
+            and (not ctx["need_comment"] or "comment" in made)):
+        groups.add("text")
+    return groups
+
+
+def row_stages(freeimage_key):
+    """(name, func) pairs in pipeline order."""
+    return [
+        ("autofill", stage_autofill),
+        ("fetch", stage_fetch),
+        ("render", stage_render),
+        ("upload", lambda ctx: stage_upload(ctx, freeimage_key)),
+        ("text", stage_text),
+    ]
+
+
+def stage_workers(network_workers):
+    """
+    Workers per stage. Network-bound stages run `network_workers` wide,
+    render is sized to the CPU count (or to the render process pool, one
+    feeding thread per process). STAGE_WORKERS overrides any of them,
+    e.g. "upload=4,render=2".
+    """
+    workers = {
+        "autofill": network_workers,
+        "fetch": network_workers,
+        "render": (
+            render_pool.RENDER_PROCESSES if render_pool.RENDER_BACKEND == "process"
+            else os.cpu_count() or 1
+        ),
+        "upload": network_workers,
+        "text": network_workers,
+    }
+    for part in STAGE_WORKERS.split(","):
+        name, _, value = part.partition("=")
+        name = name.strip()
+        if name in workers and value.strip().isdigit():
+            workers[name] = max(1, int(value))
+    return workers
+
+
+# ---------------------------
+# MAIN GOOGLE SHEET PROCESSOR
+# ---------------------------
+def process_sheet(sheet, freeimage_key, workers=None, progress=None):
+    """
+    Process every row of the sheet and write the results back.
+
+    Rows flow through a staged pipeline (autofill → fetch → render →
+    upload → text), each stage with its own worker pool and a bounded
+    queue in front of it. `workers` sets the width of the network-bound
+    stages (default: PROCESS_WORKERS env var); 1 processes rows one
+    after another on the calling thread.
+
+    `progress` (optional, e.g. a jobs.Job) is told how many rows need
+    work, when each finishes, and given the live pipeline stats.
+    """
+    if workers is None:
+        workers = PROCESS_WORKERS
+    workers = max(1, int(workers))
+
+    logger.info(f"START processing… (workers={workers})")
+
+    # Rows other workers finish after this read are not ours to redo
+    snapshot = time.time()
+    records = sheet.get_all_records()
+    writer = SheetWriter(sheet, sheet.row_values(1))
+
+    # Ensure output + autofill input columns (missing headers are
+    # written together with the results)
+    cols = {name: writer.ensure(name) for name in OUTPUT_COLUMNS + AUTOFILL_COLUMNS}
+
+    # ----------------------------------------
+    # PRE-PASS: skip rows that are already done
+    # ----------------------------------------
+    key = row_store.sheet_key(sheet)
+    remembered = row_store.load(key)
+    recorded = job_journal.load(key)
+
+    results = [None] * len(records)
+    refreshed = {}  # row -> output groups rebuilt from the current inputs
+    pending = []
+    counts = {"complete": 0, "changed": 0, "partial": 0, "new": 0}
+
+    for idx, row in enumerate(records, start=2):
+        stale = row_store.stale_outputs(row, remembered.get(idx))
+        state = classify_row(row, stale)
+        counts[state] += 1
+        if state == "complete":
+            results[idx - 2] = existing_result(row)
+            refreshed[idx] = set(row_store.GROUPS)
+        else:
+            fp = job_journal.input_fingerprint(row)
+            journal = {
+                "key": key,
+                "fp": fp,
+                "stages": job_journal.resume_state(recorded, idx, fp),
+            }
+            pending.append((idx, row, stale, journal))
+
+    logger.info(
+        f"Pre-pass: {counts['complete']} complete, {counts['changed']} changed, "
+        f"{counts['partial']} partial, {counts['new']} new rows"
+    )
+    if progress:
+        progress.begin(total=len(records), pending=len(pending))
+
+    # ----------------------------------------
+    # PROCESS ROWS
+    # ----------------------------------------
+    # Finished rows are written back progressively (write-behind), and
+    # only cells whose value actually changed are sent. Rows are leased
+    # in chunks so several workers can share the sheet without overlap.
+    claimer = RowClaimer(key, snapshot)
+
+    def rows_flushed(rows):
+        # Once a row is in the sheet its journal entries are no longer
+        # needed, and its chunk can be released as done
+        job_journal.clear(key, rows)
+        claimer.rows_flushed(rows)
+
+    buffer = WriteBehind(writer, on_flush=rows_flushed)
+
+    sizes = stage_workers(workers)
+
+    def claimed_rows():
+        # One batched PA-API pre-pass per leased chunk
+        on_skip = progress.rows_elsewhere if progress else None
+        for items in claimer.claim_chunks(pending, on_skip=on_skip):
+            ctxs = [new_row_context(*item) for item in items]
+            prefetch_products(ctxs, workers=sizes["autofill"] if workers > 1 else 1)
+            yield from ctxs
+
+    def row_finished(ctx, result):
+        idx = ctx["idx"]
+        results[idx - 2] = result
+        if ctx.get("error") is None:
+            # failed rows keep their previous record
+            refreshed[idx] = refreshed_groups(ctx)
+        if progress:
+            progress.row_finished(idx)
+        row = records[idx - 2]
+        buffer.put(idx, changed_cells(
+            idx,
+            {col: [result[name]] for name, col in cols.items()},
+            {col: [row.get(name, "")] for name, col in cols.items()},
+        ))
+
+    buffer.start()
+    try:
+        if pending:
+            stages = [
+                Stage(
+                    name, func,
+                    workers=1 if workers == 1 else sizes[name],
+                    queue_size=PIPELINE_QUEUE_SIZE,
+                )
+                for name, func in row_stages(freeimage_key)
+            ]
+
+            def on_done(ctx):
+                # rows finish out of order; they are addressed by sheet row
+                row_finished(ctx, finish_row(ctx))
+
+            pipeline = StagedPipeline(stages, on_done=on_done)
+            if progress:
+                progress.track(pipeline.stats)
+            if workers == 1:
+                pipeline.run_inline(claimed_rows())
+            else:
+                pipeline.run(claimed_rows())
+            logger.info(f"Pipeline stats: {pipeline.stats()}")
+    finally:
+        # ---------------------------
+        # WRITE BACK REMAINING ROWS
+        # ---------------------------
+        try:
+            buffer.close()
+        finally:
+            claimer.close()
+        logger.info(f"Sheet write-back: {buffer.rows_written} row(s) in {buffer.flushes} flush(es)")
+        if claimer.rows_skipped:
+            logger.info(f"{claimer.rows_skipped} row(s) left to other workers")
+
+    # Remember what each row was built from for the next run
+    row_store.save(key, [
+        (idx, {**row, **results[idx - 2]}, refreshed[idx])
+        for idx, row in enumerate(records, start=2)
+        if idx in refreshed
+    ], remembered)
 
     logger.info("FINISHED processing.")
@@ -0,0 +1,285 @@
+# modules/row_leases.py
+#
+# Lets several uvicorn workers (or instances) share one sheet. Rows are
+# grouped into fixed chunks by sheet row number; a worker only processes
+# a chunk while it holds an expiring lease on it. Leases are renewed by a
+# heartbeat and simply expire if the worker dies, so another worker picks
+# the chunk up. A lease whose owner ran on this host and is gone (e.g.
+# after a restart) is taken over at once instead of waiting for expiry.
+#
+# Backends are pluggable: "sqlite" (default, workers on one host sharing
+# STATE_DIR) and "none" (no coordination). Others can be added with
+# register_backend().
+
+import os
+import time
+import uuid
+import socket
+import logging
+import threading
+
+from modules.local_store import LocalStore
+
+logger = logging.getLogger(__name__)
+
+LEASE_BACKEND = os.getenv("ROW_LEASE_BACKEND", "sqlite")
+LEASE_CHUNK_ROWS = int(os.getenv("ROW_LEASE_CHUNK_ROWS", "25"))
+# Seconds a lease lives without renewal; the heartbeat renews every TTL/3
+LEASE_TTL = float(os.getenv("ROW_LEASE_TTL", "60"))
+
+_live_owners = set()  # owners of the RowClaimers open in this process
+
+
+def _pid_alive(pid):
+    if os.name != "posix":
+        return True  # no cheap, side-effect free check; rely on expiry
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
+
+
+def owner_gone(owner):
+    """True if `owner` (host:pid:id) ran on this host and no longer exists."""
+    try:
+        host, pid, _ = owner.rsplit(":", 2)
+        pid = int(pid)
+    except (AttributeError, ValueError):
+        return False
+    if host != socket.gethostname():
+        return False
+    if pid == os.getpid():
+        # an earlier process with our pid (e.g. pid 1 in a restarted container)
+        return owner not in _live_owners
+    return not _pid_alive(pid)
+
+
+# ---------------------------
+# BACKENDS
+# ---------------------------
+class NoLeaseBackend:
+    """Every claim succeeds: one worker, no coordination."""
+
+    def claim(self, sheet_key, chunk, owner, ttl, snapshot):
+        return True
+
+    def renew(self, sheet_key, chunks, owner, ttl):
+        pass
+
+    def complete(self, sheet_key, chunk, owner):
+        pass
+
+    def release(self, sheet_key, chunk, owner):
+        pass
+
+
+class SqliteLeaseBackend(NoLeaseBackend):
+    """
+    Lease table in STATE_DIR. A chunk can be claimed when nobody holds a
+    live lease on it and it was not completed by someone else after the
+    claimer read the sheet (`snapshot`), since that read would be stale.
+    """
+
+    def __init__(self):
+        self._store = LocalStore("row_leases.sqlite3", """
+CREATE TABLE IF NOT EXISTS row_leases (
+    sheet_key    TEXT NOT NULL,
+    chunk        INTEGER NOT NULL,
+    owner        TEXT,
+    expires_at   REAL NOT NULL DEFAULT 0,
+    completed_at REAL,
+    PRIMARY KEY (sheet_key, chunk)
+);
+""")
+
+    def claim(self, sheet_key, chunk, owner, ttl, snapshot):
+        now = time.time()
+        claimed = self._store.execute(
+            "INSERT INTO row_leases (sheet_key, chunk, owner, expires_at) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (sheet_key, chunk) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at "
+            "WHERE (row_leases.expires_at < ? OR row_leases.owner = excluded.owner) "
+            "AND (row_leases.completed_at IS NULL OR row_leases.completed_at < ?)",
+            (sheet_key, chunk, owner, now + ttl, now, snapshot),
+        )
+        if claimed:
+            return True
+
+        # Live lease held by someone else: take it over if its owner is dead
+        rows = self._store.query(
+            "SELECT owner FROM row_leases WHERE sheet_key = ? AND chunk = ?",
+            (sheet_key, chunk),
+        )
+        holder = rows[0][0] if rows else None
+        if not holder or not owner_gone(holder):
+            return False
+        logger.info(f"Taking over lease on chunk {chunk} from dead owner {holder}")
+        return self._store.execute(
+            "UPDATE row_leases SET owner = ?, expires_at = ? "
+            "WHERE sheet_key = ? AND chunk = ? AND owner = ? "
+            "AND (completed_at IS NULL OR completed_at < ?)",
+            (owner, now + ttl, sheet_key, chunk, holder, snapshot),
+        ) > 0
+
+    def renew(self, sheet_key, chunks, owner, ttl):
+        expires = time.time() + ttl
+        self._store.executemany(
+            "UPDATE row_leases SET expires_at = ? WHERE sheet_key = ? AND chunk = ? AND owner = ?",
+            [(expires, sheet_key, chunk, owner) for chunk in chunks],
+        )
+
+    def complete(self, sheet_key, chunk, owner):
+        self._store.execute(
+            "UPDATE row_leases SET owner = NULL, expires_at = 0, completed_at = ? "
+            "WHERE sheet_key = ? AND chunk = ? AND owner = ?",
+            (time.time(), sheet_key, chunk, owner),
+        )
+
+    def release(self, sheet_key, chunk, owner):
+        self._store.execute(
+            "UPDATE row_leases SET owner = NULL, expires_at = 0 "
+            "WHERE sheet_key = ? AND chunk = ? AND owner = ?",
+            (sheet_key, chunk, owner),
+        )
+
+
+BACKENDS = {
+    "none": NoLeaseBackend,
+    "sqlite": SqliteLeaseBackend,
+}
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def register_backend(name, cls):
+    """Make another lease backend selectable through ROW_LEASE_BACKEND."""
+    BACKENDS[name] = cls
+
+
+def get_backend():
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            cls = BACKENDS.get(LEASE_BACKEND)
+            if cls is None:
+                logger.error(f"Unknown ROW_LEASE_BACKEND {LEASE_BACKEND!r}; row leases disabled")
+                cls = NoLeaseBackend
+            _backend = cls()
+        return _backend
+
+
+# ---------------------------
+# CLAIMING ROWS FOR ONE RUN
+# ---------------------------
+class RowClaimer:
+    """
+    Hands out only the pending rows whose chunk this worker could lease.
+
+        claimer = RowClaimer(key, snapshot)
+        for items in claimer.claim_chunks(pending):   # item[0] is the sheet row
+            ...
+        claimer.rows_flushed([row, ...])      # after they are in the sheet
+        claimer.close()
+    """
+
+    def __init__(self, sheet_key, snapshot, backend=None,
+                 chunk_rows=LEASE_CHUNK_ROWS, ttl=LEASE_TTL):
+        self.sheet_key = sheet_key
+        self.snapshot = snapshot
+        self.backend = backend or get_backend()
+        self.chunk_rows = max(1, int(chunk_rows))
+        self.ttl = ttl
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        _live_owners.add(self.owner)
+
+        self._lock = threading.Lock()
+        self._open = {}  # chunk -> rows not yet flushed
+        self._stop = threading.Event()
+        self._heartbeat = None
+
+        self.rows_skipped = 0
+
+    def chunk_of(self, row_num):
+        return (row_num - 2) // self.chunk_rows
+
+    def claim_chunks(self, pending, on_skip=None):
+        """
+        Yield, as one list per leased chunk, the items of `pending` (tuples
+        starting with the sheet row) whose chunk this worker leased. Chunks
+        are claimed lazily, as the caller asks for more rows. `on_skip(n)`
+        is told about rows left to other workers.
+        """
+        chunks = {}
+        for item in pending:
+            chunks.setdefault(self.chunk_of(item[0]), []).append(item)
+
+        self._start_heartbeat()
+        for chunk in sorted(chunks):
+            items = chunks[chunk]
+            try:
+                claimed = self.backend.claim(self.sheet_key, chunk, self.owner, self.ttl, self.snapshot)
+            except Exception as e:
+                logger.warning(f"Lease claim failed for chunk {chunk}: {e}")
+                claimed = False
+
+            if not claimed:
+                logger.info(f"Rows chunk {chunk} is leased by another worker; skipping {len(items)} row(s)")
+                self.rows_skipped += len(items)
+                if on_skip:
+                    on_skip(len(items))
+                continue
+
+            with self._lock:
+                self._open[chunk] = {item[0] for item in items}
+            yield items
+
+    def rows_flushed(self, row_nums):
+        """Rows are in the sheet; complete chunks that have nothing left."""
+        done = []
+        with self._lock:
+            for row_num in row_nums:
+                chunk = self.chunk_of(row_num)
+                rows = self._open.get(chunk)
+                if rows is None:
+                    continue
+                rows.discard(row_num)
+                if not rows:
+                    del self._open[chunk]
+                    done.append(chunk)
+        for chunk in done:
+            try:
+                self.backend.complete(self.sheet_key, chunk, self.owner)
+            except Exception as e:
+                logger.warning(f"Failed to complete lease on chunk {chunk}: {e}")
+
+    def close(self):
+        """Stop renewing and give back chunks that never finished."""
+        self._stop.set()
+        if self._heartbeat:
+            self._heartbeat.join()
+        with self._lock:
+            leftover, self._open = list(self._open), {}
+        for chunk in leftover:
+            try:
+                self.backend.release(self.sheet_key, chunk, self.owner)
+            except Exception as e:
+                logger.warning(f"Failed to release lease on chunk {chunk}: {e}")
+        _live_owners.discard(self.owner)
+
+    def _start_heartbeat(self):
+        if self._heartbeat is None:
+            self._heartbeat = threading.Thread(target=self._renew_loop, name="row-leases", daemon=True)
+            self._heartbeat.start()
+
+    def _renew_loop(self):
+        while not self._stop.wait(self.ttl / 3):
+            with self._lock:
+                held = list(self._open)
+            if held:
+                try:
+                    self.backend.renew(self.sheet_key, held, self.owner, self.ttl)
+                except Exception as e:
+                    logger.warning(f"Lease renewal failed: {e}")
@@ -0,0 +1,149 @@
+# modules/row_store.py
+#
+# Remembers, per sheet row, a fingerprint of the inputs each output was
+# built from. When an input changes (e.g. PRICE), the next run knows the
+# existing output is stale and regenerates it without anyone clearing it.
+
+import json
+import time
+import hashlib
+import logging
+
+from modules.local_store import LocalStore
+
+logger = logging.getLogger(__name__)
+
+# Inputs that shape the two images and the caption/comment respectively
+IMAGE_INPUTS = ["IMAGEURL", "PRICE", "REG", "BADGE", "COLOR"]
+TEXT_INPUTS = ["DEAL_URL", "PRODUCT_TITLE", "PROMO_CODE"]
+
+IMAGE_OUTPUTS = ["EDITED_IMAGE", "PINTREST_EDITED"]
+TEXT_OUTPUTS = ["CAPTION_WITH_HASHTAG", "COMMENTS"]
+
+# Output group -> (record field, inputs it is built from)
+GROUPS = {
+    "images": ("image_fp", IMAGE_INPUTS),
+    "text": ("text_fp", TEXT_INPUTS),
+}
+
+_store = LocalStore("row_state.sqlite3", """
+CREATE TABLE IF NOT EXISTS row_fingerprints (
+    sheet_key  TEXT NOT NULL,
+    row_num    INTEGER NOT NULL,
+    image_fp   TEXT NOT NULL,
+    text_fp    TEXT NOT NULL,
+    outputs    TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (sheet_key, row_num)
+);
+""")
+
+
+def sheet_key(sheet):
+    """Stable identity for a worksheet: spreadsheet id + tab id."""
+    spreadsheet_id = getattr(sheet, "spreadsheet_id", None)
+    if spreadsheet_id is None:
+        spreadsheet_id = getattr(getattr(sheet, "spreadsheet", None), "id", "")
+    return f"{spreadsheet_id}:{getattr(sheet, 'id', '')}"
+
+
+def _value(row, name):
+    if name == "COLOR":
+        value = row.get("COLOR") or row.get("BADGE_COLOR")
+    else:
+        value = row.get(name)
+    return "" if value is None else str(value).strip()
+
+
+def fingerprint(row, fields):
+    raw = json.dumps([_value(row, f) for f in fields], ensure_ascii=False)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def _outputs(row):
+    return {name: _value(row, name) for name in IMAGE_OUTPUTS + TEXT_OUTPUTS}
+
+
+def load(key):
+    """{row_num: record} for every remembered row of the sheet."""
+    try:
+        rows = _store.query(
+            "SELECT row_num, image_fp, text_fp, outputs FROM row_fingerprints WHERE sheet_key = ?",
+            (key,),
+        )
+    except Exception as e:
+        logger.warning(f"Row fingerprint store unavailable: {e}")
+        return {}
+    return {
+        r[0]: {"image_fp": r[1], "text_fp": r[2], "outputs": json.loads(r[3])}
+        for r in rows
+    }
+
+
+def stale_outputs(row, record):
+    """
+    Which output groups ("images", "text") of a row are out of date.
+
+    A group is stale only when the sheet still shows the outputs we last
+    wrote for this row and its input fingerprint has changed since. Rows
+    we have no record of (or whose outputs were edited by hand, or that
+    moved) are never considered stale.
+    """
+    if not record:
+        return set()
+
+    current = _outputs(row)
+    saved = record["outputs"]
+    stale = set()
+
+    if (all(current[n] == saved.get(n, "") for n in IMAGE_OUTPUTS)
+            and fingerprint(row, IMAGE_INPUTS) != record["image_fp"]):
+        stale.add("images")
+
+    if (all(current[n] == saved.get(n, "") for n in TEXT_OUTPUTS)
+            and fingerprint(row, TEXT_INPUTS) != record["text_fp"]):
+        stale.add("text")
+
+    return stale
+
+
+def _group_fp(values, group, refreshed, record):
+    """
+    Fingerprint to remember for one output group. A group that was not
+    rebuilt from these inputs keeps the fingerprint it had, so it is
+    still stale next run.
+    """
+    field, inputs = GROUPS[group]
+    if group in refreshed or not record:
+        return fingerprint(values, inputs)
+    return record[field]
+
+
+def save(key, rows, remembered=None):
+    """
+    Remember the inputs/outputs now in the sheet.
+    `rows` is a list of (row_num, values, refreshed) where values holds
+    every input and output column as written back and refreshed names
+    the groups rebuilt from those inputs. `remembered` is what load()
+    returned before the run.
+    """
+    remembered = remembered or {}
+    now = time.time()
+    try:
+        _store.executemany(
+            "INSERT OR REPLACE INTO row_fingerprints "
+            "(sheet_key, row_num, image_fp, text_fp, outputs, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+            [
+                (
+                    key,
+                    row_num,
+                    _group_fp(values, "images", refreshed, remembered.get(row_num)),
+                    _group_fp(values, "text", refreshed, remembered.get(row_num)),
+                    json.dumps(_outputs(values), ensure_ascii=False),
+                    now,
+                )
+                for row_num, values, refreshed in rows
+            ],
+        )
+    except Exception as e:
+        logger.warning(f"Failed to save row fingerprints: {e}")
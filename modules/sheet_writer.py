@@ -0,0 +1,316 @@
+# modules/sheet_writer.py
+#
+# Collects header and value updates for a worksheet and sends them with
+# as few `batch_update` round trips as the Sheets payload limits allow.
+
+import os
+import time
+import logging
+import threading
+from gspread.utils import rowcol_to_a1
+
+logger = logging.getLogger(__name__)
+
+# Keep each values.batchUpdate request comfortably under the API limits
+MAX_BATCH_CELLS = int(os.getenv("SHEETS_MAX_BATCH_CELLS", "40000"))
+MAX_BATCH_BYTES = int(os.getenv("SHEETS_MAX_BATCH_BYTES", "2000000"))
+
+# Write-behind: flush finished rows every FLUSH_ROWS rows or FLUSH_SECONDS,
+# but never more often than MIN_FLUSH_INTERVAL (Sheets allows ~60 writes/min)
+FLUSH_ROWS = int(os.getenv("SHEETS_FLUSH_ROWS", "20"))
+FLUSH_SECONDS = float(os.getenv("SHEETS_FLUSH_SECONDS", "10"))
+MIN_FLUSH_INTERVAL = float(os.getenv("SHEETS_MIN_FLUSH_INTERVAL", "2"))
+
+
+def a1_range(first_row, first_col, last_row, last_col):
+    """A1 range for a rectangle; works past column Z (AA, AB, ...)."""
+    return f"{rowcol_to_a1(first_row, first_col)}:{rowcol_to_a1(last_row, last_col)}"
+
+
+def same_value(a, b):
+    """
+    Compare a computed value with one read back from the sheet.
+    get_all_records() turns numeric strings into numbers, so compare text.
+    """
+    a = "" if a is None else str(a)
+    b = "" if b is None else str(b)
+    return a == b
+
+
+def changed_cells(first_row, columns, previous):
+    """
+    {(row, col): value} for every value in `columns` that differs from
+    `previous` (both map column number -> values starting at `first_row`).
+    """
+    cells = {}
+    for col, values in columns.items():
+        old = previous.get(col, [])
+        for i, value in enumerate(values):
+            if not same_value(value, old[i] if i < len(old) else ""):
+                cells[(first_row + i, col)] = value
+    return cells
+
+
+def _cell_bytes(value):
+    # rough JSON size of one cell: the value plus quotes and a comma
+    return len(str(value).encode("utf-8")) + 4
+
+
+class SheetWriter:
+    """
+    Buffer of pending writes for one worksheet.
+
+        writer = SheetWriter(sheet, sheet.row_values(1))
+        col = writer.ensure("EDITED_IMAGE")
+        writer.add(2, col, [["url"], ["url"]])
+        writer.flush()
+    """
+
+    def __init__(self, sheet, headers):
+        self.sheet = sheet
+        self.headers = list(headers)
+        self._new_headers = []
+        self._ranges = []  # (first_row, first_col, values)
+
+    def ensure(self, name):
+        """Column number of header `name`, creating it (on flush) if missing."""
+        if name in self.headers:
+            return self.headers.index(name) + 1
+        self.headers.append(name)
+        self._new_headers.append(name)
+        return len(self.headers)
+
+    def add(self, first_row, first_col, values):
+        """Queue a 2D block of values with its top-left cell at (first_row, first_col)."""
+        if values:
+            self._ranges.append((first_row, first_col, values))
+
+    def add_columns(self, first_row, columns):
+        """
+        Queue whole columns: `columns` maps column number -> list of values
+        starting at `first_row`. Side-by-side columns of equal length are
+        merged into one rectangular range.
+        """
+        run = []
+        for col in sorted(columns):
+            if run and (col != run[-1] + 1 or len(columns[col]) != len(columns[run[0]])):
+                self._add_column_run(first_row, run, columns)
+                run = []
+            run.append(col)
+        if run:
+            self._add_column_run(first_row, run, columns)
+
+    def add_cells(self, cells):
+        """
+        Queue individual cells, `cells` mapping (row, col) -> value.
+        Consecutive rows in a column become one range, and side-by-side
+        columns spanning the same rows share a range.
+        """
+        by_col = {}
+        for (row, col), value in cells.items():
+            by_col.setdefault(col, {})[row] = value
+
+        spans = {}
+        for col, rows in by_col.items():
+            ordered = sorted(rows)
+            start = prev = ordered[0]
+            for row in ordered[1:] + [None]:
+                if row is not None and row == prev + 1:
+                    prev = row
+                    continue
+                spans.setdefault((start, prev), []).append(col)
+                if row is not None:
+                    start = prev = row
+
+        for (start, end), cols in sorted(spans.items()):
+            self.add_columns(start, {
+                c: [by_col[c][r] for r in range(start, end + 1)] for c in cols
+            })
+
+    def _add_column_run(self, first_row, run, columns):
+        values = [list(cells) for cells in zip(*(columns[c] for c in run))]
+        self.add(first_row, run[0], values)
+
+    # ---------------------------
+    # FLUSH
+    # ---------------------------
+    def _pending_ranges(self):
+        ranges = list(self._ranges)
+        if self._new_headers:
+            first_col = len(self.headers) - len(self._new_headers) + 1
+            ranges.insert(0, (1, first_col, [list(self._new_headers)]))
+        return ranges
+
+    def _grow_columns(self, ranges):
+        needed = max(col + len(values[0]) - 1 for _, col, values in ranges)
+        have = getattr(self.sheet, "col_count", None)
+        if have is not None and needed > have:
+            self.sheet.add_cols(needed - have)
+
+    def _split(self, first_row, first_col, values):
+        """Yield (range, values, cells, bytes) pieces that each fit in one batch."""
+        width = len(values[0])
+        start = 0
+        while start < len(values):
+            cells = 0
+            size = 0
+            end = start
+            while end < len(values):
+                row_bytes = sum(_cell_bytes(v) for v in values[end])
+                if end > start and (cells + width > MAX_BATCH_CELLS or size + row_bytes > MAX_BATCH_BYTES):
+                    break
+                cells += width
+                size += row_bytes
+                end += 1
+            rng = a1_range(first_row + start, first_col, first_row + end - 1, first_col + width - 1)
+            yield rng, values[start:end], cells, size
+            start = end
+
+    def _batches(self, ranges):
+        batch, cells, size = [], 0, 0
+        for first_row, first_col, values in ranges:
+            for rng, block, n_cells, n_bytes in self._split(first_row, first_col, values):
+                if batch and (cells + n_cells > MAX_BATCH_CELLS or size + n_bytes > MAX_BATCH_BYTES):
+                    yield batch
+                    batch, cells, size = [], 0, 0
+                batch.append({"range": rng, "values": block})
+                cells += n_cells
+                size += n_bytes
+        if batch:
+            yield batch
+
+    def flush(self):
+        """Send everything queued. Returns the number of batch_update calls made."""
+        ranges = self._pending_ranges()
+        if not ranges:
+            return 0
+
+        self._grow_columns(ranges)
+
+        calls = 0
+        for batch in self._batches(ranges):
+            self.sheet.batch_update(batch)
+            calls += 1
+
+        self._ranges = []
+        self._new_headers = []
+        logger.info(f"Wrote {len(ranges)} range(s) to sheet in {calls} batch_update call(s)")
+        return calls
+
+
+class WriteBehind:
+    """
+    Background flusher in front of a SheetWriter. Finished rows are handed
+    over with put(); a worker thread writes them out in coalesced batches
+    once FLUSH_ROWS rows are waiting or FLUSH_SECONDS have passed, so
+    results show up progressively and survive a crash mid-run.
+
+        buffer = WriteBehind(writer)
+        buffer.start()
+        buffer.put(row, {(row, col): value, ...})
+        buffer.close()   # final flush
+
+    `on_flush(row_nums)` is called after each successful flush with the
+    rows it made durable.
+    """
+
+    def __init__(self, writer, flush_rows=FLUSH_ROWS, flush_seconds=FLUSH_SECONDS,
+                 min_interval=MIN_FLUSH_INTERVAL, on_flush=None):
+        self.writer = writer
+        self.on_flush = on_flush
+        self.flush_rows = max(1, int(flush_rows))
+        self.flush_seconds = flush_seconds
+        self.min_interval = min_interval
+
+        self._cells = {}
+        self._rows = []
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = None
+        self._last_flush = 0.0
+        self._first_pending = None
+
+        self.flushes = 0
+        self.rows_written = 0
+
+    def put(self, row_num, cells):
+        """Queue one finished row's changed cells ({(row, col): value})."""
+        with self._cond:
+            self._rows.append(row_num)
+            if cells:
+                self._cells.update(cells)
+                if self._first_pending is None:
+                    self._first_pending = time.monotonic()
+            if len(self._rows) >= self.flush_rows:
+                self._cond.notify()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, name="sheet-writer", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """Stop the flusher and write whatever is still queued."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        if self._thread:
+            self._thread.join()
+        self._flush()
+
+    def _due(self):
+        if not self._cells and not self.writer._new_headers:
+            return False
+        if time.monotonic() - self._last_flush < self.min_interval:
+            return False
+        if len(self._rows) >= self.flush_rows:
+            return True
+        return (self._first_pending is not None
+                and time.monotonic() - self._first_pending >= self.flush_seconds)
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while not self._closed and not self._due():
+                    self._cond.wait(timeout=0.5)
+                if self._closed:
+                    return
+            self._flush()
+
+    def _flush(self):
+        with self._cond:
+            cells, rows = self._cells, self._rows
+            self._cells, self._rows = {}, []
+            self._first_pending = None
+            self._last_flush = time.monotonic()
+
+        if not cells and not self.writer._new_headers:
+            self._flushed(rows)
+            return
+
+        try:
+            if cells:
+                self.writer.add_cells(cells)
+            self.writer.flush()
+            self.flushes += 1
+            self.rows_written += len(rows)
+        except Exception:
+            logger.exception("Sheet write-behind flush failed; will retry")
+            self.writer._ranges = []
+            with self._cond:
+                # keep newer values that arrived meanwhile
+                self._cells = {**cells, **self._cells}
+                self._rows = rows + self._rows
+                if self._first_pending is None:
+                    self._first_pending = time.monotonic()
+            if self._closed:
+                raise
+            return
+
+        self._flushed(rows)
+
+    def _flushed(self, rows):
+        if self.on_flush and rows:
+            try:
+                self.on_flush(rows)
+            except Exception:
+                logger.exception("Write-behind on_flush callback failed")